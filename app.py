@@ -1,18 +1,30 @@
-import time
 import os
-import io
-import math
+import re
 import json
-import requests
-from flask import Flask, request, send_from_directory, jsonify
+from flask import Flask, Response, request, send_from_directory, jsonify, stream_with_context
 from flask_cors import CORS
-from PIL import Image, ImageDraw, ImageFont
 import torch
-from ultralytics import YOLO
 import numpy as np
 from dotenv import load_dotenv
 from openai import OpenAI
-import cv2  # 使用 cv2.boxPoints 取得旋轉矩形的頂點
+from tiling import MAX_DECODE_PIXELS, ImageTooLargeError, TiledImageReader, iter_batches
+from inference_scheduler import InferenceScheduler
+from inference_workers import InferenceWorkerPool
+from inference_backends import create_backend, export_onnx
+from obb_utils import obbs_to_bboxes
+from detection import (
+    ALLOWED_CLASSES, CONF_THRESHOLD, NMS_IOU_THRESHOLD, TILE_BATCH_SIZE, TILE_OVERLAP, TILE_SIZE,
+    draw_obb_bboxes, merge_overlapping_obbs, run_yolo11n_obb_on_batch_tiles,
+)
+from model_registry import ModelRegistry
+from result_cache import ResultCache, make_result_key, SOURCE_FILE, ANNOTATED_FILE
+from geocode_cache import GeocodeCache, normalize_place_name
+from concurrent.futures import ThreadPoolExecutor
+from http_client import HttpClient, CircuitBreaker
+from geodesic import buffer_rings
+from gazetteer import load_gazetteer
+from llm_cache import TTLCache, make_cache_key, normalize_prompt, schema_version
+from geojson_codec import DEFAULT_PRECISION, dumps_compact, parse_precision, round_geojson
 
 # 從 .env 文件中載入環境變數
 load_dotenv()
@@ -21,45 +33,217 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
-# 載入 YOLO11n OBB 模型（取代原本的 YOLOv8 模型）
-model = YOLO('yolov8n.pt')  # 舊版 YOLOv8 模型範例
-# model = YOLO('yolo11n-obb.pt')  # 使用 OBB 權重模型
-# model = YOLO('yolo11x-obb.pt')  # 使用 OBB 權重模型
+# 可供 /analyze 選用的模型（名稱 -> 權重檔）
+AVAILABLE_MODELS = {
+    'yolov8n': 'yolov8n.pt',  # 舊版 YOLOv8 模型範例
+    'yolo11n-obb': 'yolo11n-obb.pt',  # 使用 OBB 權重模型
+    'yolo11x-obb': 'yolo11x-obb.pt',  # 使用 OBB 權重模型
+}
+DEFAULT_MODEL = os.environ.get("DEFAULT_MODEL", 'yolov8n')
 
-# 檢查是否有可用的 CUDA 並將模型移動到 GPU
-if torch.cuda.is_available():
-    model.to('cuda')
+# 檢查是否有可用的 CUDA，模型載入時會移動到 GPU
+USE_CUDA = torch.cuda.is_available()
+if USE_CUDA:
     print("使用 CUDA 進行推理")
 else:
     print("未啟用 CUDA，使用 CPU")
 
+
+# 推理後端：torch（ultralytics）或 onnx（匯出後以 onnxruntime CPU 執行）
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch")
+
+# INFERENCE_WORKERS > 0 時（僅 CPU），每個模型改由多個 worker 行程各持一份推理
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 0))
+INFERENCE_TORCH_THREADS = int(os.environ.get("INFERENCE_TORCH_THREADS", 0)) or None
+
+
+def load_model(name):
+    """
+    載入模型並以空白影像做一次 warm-up，
+    回傳包裝好的推理佇列：所有 /analyze 請求共用，將多個請求的 tile 合併成同一批次送入模型。
+    """
+    weights = AVAILABLE_MODELS[name]
+    if INFERENCE_BACKEND == "onnx":
+        # 先在主行程匯出一次並改傳 .onnx 路徑，worker 不必再載入 torch 模型或同時匯出同一份權重
+        weights = export_onnx(weights)
+    if INFERENCE_WORKERS > 0 and not USE_CUDA:
+        model = InferenceWorkerPool(INFERENCE_BACKEND, weights, INFERENCE_WORKERS, INFERENCE_TORCH_THREADS)
+    else:
+        kwargs = {"device": "cuda"} if USE_CUDA and INFERENCE_BACKEND == "torch" else {}
+        model = create_backend(INFERENCE_BACKEND, weights, **kwargs)
+        model.warmup()
+    return InferenceScheduler(
+        model,
+        max_batch_size=int(os.environ.get("INFERENCE_MAX_BATCH_SIZE", 16)),
+        max_wait_ms=float(os.environ.get("INFERENCE_MAX_WAIT_MS", 10)),
+    )
+
+
+def unload_model(scheduler):
+    scheduler.close()
+    if isinstance(scheduler.model, InferenceWorkerPool):
+        scheduler.model.close()
+
+
+def is_model_usable(scheduler):
+    # worker 行程意外結束的推理池已永久關閉，需由 model_registry 重新載入
+    return not getattr(scheduler.model, "failed", False)
+
+
+# 模型於第一次使用時才載入，最多常駐 MAX_RESIDENT_MODELS 個（LRU 淘汰）
+model_registry = ModelRegistry(
+    load_model,
+    max_resident=int(os.environ.get("MAX_RESIDENT_MODELS", 2)),
+    on_evict=unload_model,
+    is_usable=is_model_usable,
+)
+
 # 設定 OpenAI API 金鑰
 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
 # 從環境變數中讀取 Google Places API 金鑰
 GOOGLE_PLACES_API_KEY = os.environ.get("GOOGLE_PLACES_API_KEY")
 
+# Google Places 共用 HTTP 客戶端（連線池、timeout、重試與斷路器）；
+# 測試時可將 GOOGLE_PLACES_BASE_URL 指向本機 stub 伺服器
+places_client = HttpClient(
+    os.environ.get("GOOGLE_PLACES_BASE_URL", "https://maps.googleapis.com/maps/api/place"),
+    timeout=(
+        float(os.environ.get("GEO_HTTP_CONNECT_TIMEOUT", 3.05)),
+        float(os.environ.get("GEO_HTTP_READ_TIMEOUT", 10)),
+    ),
+    max_retries=int(os.environ.get("GEO_HTTP_MAX_RETRIES", 2)),
+    pool_size=int(os.environ.get("GEOCODE_MAX_WORKERS", 8)),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get("GEO_BREAKER_FAILURES", 5)),
+        reset_timeout=float(os.environ.get("GEO_BREAKER_RESET_SECONDS", 30)),
+    ),
+)
+
+# 地名座標快取（行程內 LRU + SQLite），查無結果的地名以較短 TTL 快取
+geocode_cache = GeocodeCache(
+    os.environ.get("GEOCODE_CACHE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "db", "geocode_cache.db")),
+    ttl=float(os.environ.get("GEOCODE_CACHE_TTL", 30 * 86400)),
+    negative_ttl=float(os.environ.get("GEOCODE_NEGATIVE_TTL", 3600)),
+    max_memory_entries=int(os.environ.get("GEOCODE_CACHE_MEMORY_SIZE", 1024)),
+)
+
+# 離線地名索引（CSV 或 GeoJSON），命中時不查快取也不連網；檔案不存在時停用
+gazetteer = load_gazetteer(
+    os.environ.get("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "db", "gazetteer.csv")),
+    fuzzy_threshold=float(os.environ.get("GAZETTEER_FUZZY_THRESHOLD", 0.85)),
+)
+if gazetteer is not None:
+    print(f"✅ 已載入離線地名索引：{len(gazetteer)} 筆")
+
+# 離線部署（無法連到 Google Places）時設為 1，離線索引與快取都查不到即視為查無此地
+GEOCODE_OFFLINE = os.environ.get("GEOCODE_OFFLINE", "0") == "1"
+
+# 多地點查詢時同時進行的地名查詢數上限（所有請求共用）
+geocode_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("GEOCODE_MAX_WORKERS", 8)),
+    thread_name_prefix="geocode",
+)
+
 # --------------------- 與地理位置相關的函式 ---------------------
-def get_location_coordinates(place_name):
-    url = "https://maps.googleapis.com/maps/api/place/findplacefromtext/json"
-    params = {
+PLACES_FIND_PATH = "findplacefromtext/json"
+
+def places_find_params(place_name):
+    return {
         "input": place_name,
         "inputtype": "textquery",
         "fields": "geometry",
         "key": GOOGLE_PLACES_API_KEY
     }
-    response = requests.get(url, params=params)
-    data = response.json()
+
+def report_places_error(place_name, ex):
+    # 逾時、重試用盡或斷路器開啟：視為查無結果但不寫入快取
+    # （只印出錯誤類型，避免錯誤訊息中的 URL 帶出 API 金鑰）
+    print(f"❌ 查詢地點座標失敗（{place_name}）:", type(ex).__name__)
+
+def store_places_result(place_name, data):
+    """解析 Places 回應並寫入快取，回傳座標或 None。"""
     if data.get("candidates"):
         location = data["candidates"][0]["geometry"]["location"]
-        return {"latitude": location["lat"], "longitude": location["lng"]}
-    else:
+        coordinates = {"latitude": location["lat"], "longitude": location["lng"]}
+        geocode_cache.put(place_name, coordinates)
+        return coordinates
+    if data.get("status") == "ZERO_RESULTS":
+        # 只快取「確定查無此地」；金鑰錯誤、配額用盡等暫時性失敗不快取
+        geocode_cache.put(place_name, None)
+    return None
+
+def gazetteer_lookup(place_name, approximate=False):
+    """查離線地名索引；approximate=True 時才接受前綴與模糊比對的結果。"""
+    if gazetteer is None:
         return None
+    return gazetteer.lookup(place_name, approximate=approximate)
 
-def get_multiple_locations(place_names):
-    features = []
+def lookup_local_coordinates(place_name):
+    """
+    不連網的查詢：依序查離線地名索引（只接受 exact）與座標快取，回傳 (是否已有結果, 座標或 None)。
+    Places 已確定查無此地或離線模式下，改用前綴 / 模糊比對，且一律視為已有結果，呼叫端不再送出 Places 請求。
+    """
+    coordinates = gazetteer_lookup(place_name)
+    if coordinates is not None:
+        return True, coordinates
+    found, cached = geocode_cache.get(place_name)
+    if found and cached is not None:
+        return True, cached
+    if found or GEOCODE_OFFLINE:
+        return True, gazetteer_lookup(place_name, approximate=True)
+    return False, None
+
+def places_lookup_failed(data):
+    """Places 回應是否為暫時性失敗（金鑰錯誤、配額用盡等），與 store_places_result 不快取的條件相同。"""
+    return not data.get("candidates") and data.get("status") != "ZERO_RESULTS"
+
+def lookup_location(place_name):
+    """
+    查詢地名座標，回傳 (座標或 None, 是否因暫時性失敗而查不到)。
+    逾時、重試用盡、斷路器開啟或 Places 回應暫時性錯誤時，第二個值為 True，
+    呼叫端據此不快取由這次查詢組成的回覆。
+    """
+    found, cached = lookup_local_coordinates(place_name)
+    if found:
+        return cached, False
+    try:
+        data = places_client.get_json(PLACES_FIND_PATH, params=places_find_params(place_name))
+    except Exception as ex:
+        report_places_error(place_name, ex)
+        return gazetteer_lookup(place_name, approximate=True), True
+    coordinates = store_places_result(place_name, data)
+    if coordinates is not None:
+        return coordinates, False
+    # Places 查無結果時才退而採用離線索引的近似比對
+    return gazetteer_lookup(place_name, approximate=True), places_lookup_failed(data)
+
+def get_location_coordinates(place_name):
+    return lookup_location(place_name)[0]
+
+def resolve_locations(place_names, lookups=None):
+    """
+    同時查詢多個地名的座標，回傳與 place_names 順序相同的列表（查無為 None）。
+    正規化後相同的地名只查一次；lookups 為 {正規化地名: (座標, 是否失敗)}，
+    已在其中的地名不再查詢，新查到的結果也寫回其中，供呼叫端判斷本輪是否有查詢失敗。
+    """
+    if lookups is None:
+        lookups = {}
+    unique = {}
     for name in place_names:
-        coordinates = get_location_coordinates(name)
+        key = normalize_place_name(name)
+        if key not in lookups:
+            unique.setdefault(key, name)
+    if len(unique) <= 1:
+        lookups.update({key: lookup_location(name) for key, name in unique.items()})
+    else:
+        futures = {key: geocode_executor.submit(lookup_location, name) for key, name in unique.items()}
+        lookups.update({key: future.result() for key, future in futures.items()})
+    return [lookups[normalize_place_name(name)][0] for name in place_names]
+
+def get_multiple_locations(place_names, lookups=None):
+    features = []
+    for name, coordinates in zip(place_names, resolve_locations(place_names, lookups)):
         if coordinates:
             feature = {
                 "type": "Feature",
@@ -80,25 +264,21 @@ def get_multiple_locations(place_names):
     else:
         return None
 
-def 建立_buffer_polygon(lon, lat, radius_km, num_points=64):
-    points = []
-    for i in range(num_points):
-        angle = 2 * math.pi * i / num_points
-        delta_lat = (radius_km / 111.32) * math.sin(angle)
-        denom = 111.32 * math.cos(math.radians(lat))
-        delta_lon = (radius_km / denom) * math.cos(angle) if abs(denom) >= 1e-6 else 0
-        points.append([lon + delta_lon, lat + delta_lat])
-    points.append(points[0])
-    return points
+# buffer 圓周點數依半徑自動決定：多邊形與真實圓周的最大誤差不超過此值（公尺）
+BUFFER_TOLERANCE_M = float(os.environ.get("BUFFER_TOLERANCE_M", 10))
+
+def 建立_buffer_polygon(lon, lat, radius_km, num_points=None):
+    """以球面 destination point 計算圓形 buffer 外環；num_points 為 None 時依半徑自動決定點數。"""
+    return buffer_rings([lon], [lat], [radius_km], num_points, BUFFER_TOLERANCE_M)[0]
 
-def get_buffer_polygon(place_name, radius_km):
+def get_buffer_polygon(place_name, radius_km, lookups=None):
     """
     取得以指定地點為中心且半徑為 radius_km 公里的圓形（buffer），
     同時回傳中心點位置，最終回傳的 GeoJSON 包含兩個 feature:
       - type 為 "Polygon" 的 buffer 圓
       - type 為 "Point" 的中心點
     """
-    center = get_location_coordinates(place_name)
+    center = resolve_locations([place_name], lookups)[0]
     if not center:
         return None
     lon = center["longitude"]
@@ -136,44 +316,50 @@ def get_buffer_polygon(place_name, radius_km):
     }
     return geojson
 
-def get_multiple_buffer_polygons(locations):
+def get_multiple_buffer_polygons(locations, lookups=None):
     """
     參數 locations 為列表，每個項目格式例如：
       {"place_name": "三芝雷達站", "radius_km": 10}
     回傳的 GeoJSON 會包含每個地點的 buffer 圓以及中心點資訊
     """
     features = []
-    for loc in locations:
-        coordinates = get_location_coordinates(loc["place_name"])
-        if coordinates:
-            lon = coordinates["longitude"]
-            lat = coordinates["latitude"]
-            polygon = 建立_buffer_polygon(lon, lat, loc["radius_km"])
-            polygon_feature = {
-                "type": "Feature",
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": [polygon]
-                },
-                "properties": {
-                    "name": loc["place_name"],
-                    "radius_km": loc["radius_km"],
-                    "feature_type": "buffer"
-                }
+    all_coordinates = resolve_locations([loc["place_name"] for loc in locations], lookups)
+    found = [(loc, c) for loc, c in zip(locations, all_coordinates) if c]
+    # 所有圓一次以陣列運算產生
+    polygons = buffer_rings(
+        [c["longitude"] for _, c in found],
+        [c["latitude"] for _, c in found],
+        [float(loc["radius_km"]) for loc, _ in found],
+        tolerance_m=BUFFER_TOLERANCE_M,
+    ) if found else []
+    for (loc, coordinates), polygon in zip(found, polygons):
+        lon = coordinates["longitude"]
+        lat = coordinates["latitude"]
+        polygon_feature = {
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [polygon]
+            },
+            "properties": {
+                "name": loc["place_name"],
+                "radius_km": loc["radius_km"],
+                "feature_type": "buffer"
             }
-            point_feature = {
-                "type": "Feature",
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [lon, lat]
-                },
-                "properties": {
-                    "name": loc["place_name"],
-                    "feature_type": "center"
-                }
+        }
+        point_feature = {
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [lon, lat]
+            },
+            "properties": {
+                "name": loc["place_name"],
+                "feature_type": "center"
             }
-            features.append(polygon_feature)
-            features.append(point_feature)
+        }
+        features.append(polygon_feature)
+        features.append(point_feature)
     if features:
         return {
             "type": "FeatureCollection",
@@ -221,18 +407,6 @@ def serve_index():
 def serve_file(filename):
     return send_from_directory(FOLDER_PATH, filename)
 
-def split_image_into_tiles(image, tile_size, overlap):
-    width, height = image.size
-    tiles = []
-    for top in range(0, height, tile_size - overlap):
-        for left in range(0, width, tile_size - overlap):
-            right = min(left + tile_size, width)
-            bottom = min(top + tile_size, height)
-            box = (left, top, right, bottom)
-            tile = image.crop(box)
-            tiles.append((tile, left, top))
-    return tiles
-
 # 針對 yolo11n-obb.pt 的 OBB 偵測功能
 # def run_yolo11n_obb_on_batch_tiles(model, tiles, draw, font):
 #     # 將 PIL 影像轉為 numpy 陣列，建立批次輸入
@@ -273,104 +447,120 @@ def split_image_into_tiles(image, tile_size, overlap):
 #                 ]
 #             })
 #     return bboxes
-def run_yolo11n_obb_on_batch_tiles(model, tiles, draw, font, allowed_classes=None):
-    # 定義預設顏色清單（若類別數超過清單數量，會重複循環）
-    colors = ['yellow','red', 'blue', 'green', 'magenta', 'cyan', 'orange', 'purple']
-    # 建立類別對應顏色的字典
-    class_color_map = {}
-    
-    # 將 PIL 影像轉為 numpy 陣列，建立批次輸入
-    batch = [np.array(tile.convert('RGB')) for tile, _, _ in tiles]
-    results = model(batch)
-    bboxes = []
-    for i, (tile, left, top) in enumerate(tiles):
-        result = results[i]
-        # 檢查 OBB 資訊是否存在
-        if result.obb is None:
-            continue
-        # 假設 OBB 格式為 [中心點_x, 中心點_y, 寬度, 高度, 角度, 信心度, 類別編號]
-        obb_data = result.obb.data.cpu().numpy()
-        for obb in obb_data:
-            cx, cy, w, h, angle, conf, cls = obb
-            class_id = int(cls)
-            class_name = model.names[class_id] if model.names is not None else str(class_id)
-            # 若指定了 allowed_classes，僅處理符合條件的類別
-            if allowed_classes is not None and class_name not in allowed_classes:
-                continue
-
-            angle_deg = angle * 180.0 / math.pi  # 轉換為角度
-            # 將 tile 偏移量轉為全域座標
-            cx_global = cx + left
-            cy_global = cy + top
-            rect = ((cx_global, cy_global), (w, h), angle_deg)
-            box = cv2.boxPoints(rect)
-            box = np.intp(box)
-            
-            # 依照類別決定顏色，若尚未建立對應則從 colors 清單中依序指派
-            if class_name not in class_color_map:
-                class_color_map[class_name] = colors[len(class_color_map) % len(colors)]
-            color = class_color_map[class_name]
-            
-            # 使用 draw.line 畫出較粗的偵測框（設定線寬為 3）
-            points = list(map(tuple, box))
-            draw.line(points + [points[0]], fill=color, width=3)
-            
-            x_text, y_text = int(np.min(box[:, 0])), int(np.min(box[:, 1]))
-            draw.text((x_text, y_text - 10), class_name, font=font, fill=color)
-            bboxes.append({
-                "class_name": class_name,
-                "class_id": class_id,
-                "obb": [
-                    float(cx_global),
-                    float(cy_global),
-                    float(w),
-                    float(h),
-                    float(angle),
-                    float(conf)
-                ]
-            })
-    return bboxes
 
+# 偵測結果快取：以影像內容、模型與參數定址，結果與標註影像保存在磁碟並依 LRU 淘汰
+RESULTS_FOLDER = os.path.join(os.getcwd(), 'analyze_results')
+result_cache = ResultCache(
+    RESULTS_FOLDER,
+    max_bytes=int(os.environ.get("RESULT_CACHE_MAX_BYTES", 2 * 1024 ** 3)),
+)
+
+
+def detect_objects(reader, model):
+    """對 TiledImageReader 逐批偵測、合併重疊 tile 的結果，最後才序列化為 bbox dict。"""
+    obbs = [
+        run_yolo11n_obb_on_batch_tiles(model, chunk, allowed_classes=ALLOWED_CLASSES, scale=reader.scale, conf_threshold=CONF_THRESHOLD)
+        for chunk in iter_batches(reader.iter_tiles(TILE_SIZE, TILE_OVERLAP), TILE_BATCH_SIZE)
+    ]
+    obbs = np.concatenate(obbs) if obbs else np.zeros((0, 7))
+    obbs = merge_overlapping_obbs(obbs, NMS_IOU_THRESHOLD)
+    return obbs_to_bboxes(obbs, model.names)
+
+
+def render_annotated_image(key, bboxes):
+    """在縮放後的底圖上繪製 bboxes，只做一次 JPEG 編碼並存入結果快取。"""
+    def write(path):
+        with open(result_cache.file_path(key, SOURCE_FILE), 'rb') as fp:
+            reader = TiledImageReader(fp)
+            base, scale = reader.render_base()
+            image = draw_obb_bboxes(base, bboxes, scale)
+            image.save(path, 'JPEG')
+            reader.close()
+    result_cache.add_file(key, ANNOTATED_FILE, write)
+
+
+def _is_truthy(value):
+    return str(value).strip().lower() not in ("0", "false", "no", "off")
 
 
 @app.route('/analyze', methods=['POST'])
 def analyze_image():
     image_file = request.files['image']
-    image = Image.open(image_file)
-    width, height = image.size
-    image = image.convert('RGB')
-    draw = ImageDraw.Draw(image)
-    font = ImageFont.load_default()
-    tile_size = 1024
-    overlap = 0
-    tiles = split_image_into_tiles(image, tile_size, overlap)
-    # bboxes = run_yolo11n_obb_on_batch_tiles(model, tiles, draw, font)
-    bboxes = run_yolo11n_obb_on_batch_tiles(model, tiles, draw, font, allowed_classes=["plane", "ship", "storage tank", "helicopter"])
-
-    img_io = io.BytesIO()
-    image.save(img_io, 'JPEG')
-    img_io.seek(0)
-    processed_image_path = os.path.join(FOLDER_PATH, 'processed_image.jpg')
-    image.save(processed_image_path)
-    timestamp = int(time.time())
-    return {
-        "bboxes": bboxes,
-        "image_size": {"width": width, "height": height},
-        "image_path": f"/static/processed_image.jpg?t={timestamp}"
+    # render=0 時只回傳偵測結果 JSON，標註影像改由 /analyze/render/<result_id> 按需產生
+    render = _is_truthy(request.form.get('render', request.args.get('render', '1')))
+    model_name = request.form.get('model', request.args.get('model', DEFAULT_MODEL))
+    if model_name not in AVAILABLE_MODELS:
+        return jsonify({'error': f'不支援的模型: {model_name}', 'available_models': list(AVAILABLE_MODELS)}), 400
+
+    tmp_path, image_digest = result_cache.stage_upload(image_file.stream)
+    result_id = make_result_key(
+        image_digest, model_name, ALLOWED_CLASSES,
+        # 推理後端與 MAX_DECODE_PIXELS（決定 JPEG draft 縮小倍率）都會影響偵測結果
+        {
+            "tile_size": TILE_SIZE, "overlap": TILE_OVERLAP, "nms_iou": NMS_IOU_THRESHOLD, "conf": CONF_THRESHOLD,
+            "backend": INFERENCE_BACKEND, "max_decode_pixels": MAX_DECODE_PIXELS,
+        },
+    )
+    result = result_cache.get(result_id)
+    if result is not None:
+        result_cache.discard_upload(tmp_path)
+    else:
+        # 以視窗方式讀取影像，tile 逐批解碼並送入模型，避免整張影像與所有 tile 同時佔用記憶體
+        try:
+            with open(tmp_path, 'rb') as fp, model_registry.use(model_name) as model:
+                reader = TiledImageReader(fp)
+                width, height = reader.size
+                bboxes = detect_objects(reader, model)
+                reader.close()
+        except ImageTooLargeError as e:
+            result_cache.discard_upload(tmp_path)
+            return jsonify({'error': str(e)}), 413
+        except Exception:
+            result_cache.discard_upload(tmp_path)
+            raise
+        result = {"bboxes": bboxes, "image_size": {"width": width, "height": height}}
+        result_cache.put(result_id, tmp_path, result)
+
+    render_url = f"/analyze/render/{result_id}"
+    response = {
+        "bboxes": result["bboxes"],
+        "image_size": result["image_size"],
+        "result_id": result_id,
+        "render_url": render_url,
+        "model": model_name
     }
+    if render:
+        if not os.path.exists(result_cache.file_path(result_id, ANNOTATED_FILE)):
+            render_annotated_image(result_id, result["bboxes"])
+        response["image_path"] = render_url
+    return response
 
-@app.route('/generate', methods=['POST'])
-def generate_text():
-    try:
-        data = request.get_json()
-        user_message = data.get('prompt', '')
-        if not user_message:
-            return jsonify({'error': '訊息為必填'}), 400
 
-        messages = [
-            {
-                "role": "system",
-                "content": '''
+@app.route('/analyze/render/<result_id>', methods=['GET'])
+def render_analyze_result(result_id):
+    if not re.fullmatch(r'[0-9a-f]{64}', result_id):
+        return jsonify({'error': '無效的 result_id'}), 400
+    result = result_cache.get(result_id)
+    if result is None:
+        return jsonify({'error': '找不到偵測結果'}), 404
+    if not os.path.exists(result_cache.file_path(result_id, ANNOTATED_FILE)):
+        render_annotated_image(result_id, result["bboxes"])
+    return send_from_directory(result_cache.entry_dir(result_id), ANNOTATED_FILE)
+
+# /generate 使用的模型、系統提示與工具定義（/generate 與 /generate/stream 共用）
+GENERATE_MODEL = "gpt-4.1-mini"
+
+# 一次對話中最多呼叫模型的次數（工具呼叫 → 回填結果 → 再呼叫），最後一次強制產生文字回覆
+GENERATE_MAX_STEPS = int(os.environ.get("GENERATE_MAX_STEPS", 4))
+
+# 同一輪的多個工具呼叫以獨立的執行緒池同時執行；
+# 不與 geocode_executor 共用，避免工具內再提交地名查詢時互相等待
+tool_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("TOOL_MAX_WORKERS", 8)),
+    thread_name_prefix="tool",
+)
+
+GENERATE_SYSTEM_PROMPT = '''
 你是個情報分析師，會使用繁體中文回覆。
 回覆時，若回答內容中有地名、地區名稱或景點，請分為兩部分回覆：
 1. 第一部分請完整回答使用者問題；
@@ -378,258 +568,602 @@ def generate_text():
    若僅查詢單一地點，請回傳 Point；若有多個地點，請以 FeatureCollection 形式回傳。
 （中略：這裡保留你原本的說明與範例，不用改，只是我省略）
 '''
-            },
-        ]
-        messages.append({"role": "user", "content": user_message})
 
-        # ✅ 使用新版 tools，而不是舊的 functions
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_location_coordinates",
-                    "description": "取得單一指定地名的經緯度",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "place_name": {
-                                "type": "string",
-                                "description": "例如 '台北101'"
-                            }
-                        },
-                        "required": ["place_name"]
+# ✅ 使用新版 tools，而不是舊的 functions
+GENERATE_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_location_coordinates",
+            "description": "取得單一指定地名的經緯度",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "place_name": {
+                        "type": "string",
+                        "description": "例如 '台北101'"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_buffer_polygon",
-                    "description": "取得以指定地名為中心，並以指定半徑（公里）劃出的 buffer 圓（GeoJSON 格式），同時回傳中心點",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "place_name": {
-                                "type": "string",
-                                "description": "例如 '台北101'"
+                },
+                "required": ["place_name"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_buffer_polygon",
+            "description": "取得以指定地名為中心，並以指定半徑（公里）劃出的 buffer 圓（GeoJSON 格式），同時回傳中心點",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "place_name": {
+                        "type": "string",
+                        "description": "例如 '台北101'"
+                    },
+                    "radius_km": {
+                        "type": "number",
+                        "description": "例如 2"
+                    }
+                },
+                "required": ["place_name", "radius_km"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_multiple_locations",
+            "description": "取得多個地名的經緯度，並以 GeoJSON 陣列格式回傳",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "place_names": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "例如 ['台北101', '淡水老街']"
+                    }
+                },
+                "required": ["place_names"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_multiple_buffer_polygons",
+            "description": "取得多個地名，以各自指定半徑劃出 buffer 圓（GeoJSON 格式），並同時回傳中心點",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "locations": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "place_name": {"type": "string", "description": "例如 '三芝雷達站'"},
+                                "radius_km": {"type": "number", "description": "例如 10"}
                             },
-                            "radius_km": {
-                                "type": "number",
-                                "description": "例如 2"
-                            }
+                            "required": ["place_name", "radius_km"]
                         },
-                        "required": ["place_name", "radius_km"]
+                        "description": "例如 [{'place_name': '三芝雷達站', 'radius_km': 10}, {'place_name': '淡水漁人碼頭', 'radius_km': 10}]"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_multiple_locations",
-                    "description": "取得多個地名的經緯度，並以 GeoJSON 陣列格式回傳",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "place_names": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "例如 ['台北101', '淡水老街']"
-                            }
+                },
+                "required": ["locations"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_polygon_from_coordinates",
+            "description": "將多個經緯度點依順序連線為 GeoJSON Polygon",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "coordinates": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "latitude":  {"type": "number"},
+                                "longitude": {"type": "number"}
+                            },
+                            "required": ["latitude", "longitude"]
                         },
-                        "required": ["place_names"]
+                        "description": "按照連線順序排列的座標列表"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_multiple_buffer_polygons",
-                    "description": "取得多個地名，以各自指定半徑劃出 buffer 圓（GeoJSON 格式），並同時回傳中心點",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "locations": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "place_name": {"type": "string", "description": "例如 '三芝雷達站'"},
-                                        "radius_km": {"type": "number", "description": "例如 10"}
-                                    },
-                                    "required": ["place_name", "radius_km"]
-                                },
-                                "description": "例如 [{'place_name': '三芝雷達站', 'radius_km': 10}, {'place_name': '淡水漁人碼頭', 'radius_km': 10}]"
-                            }
-                        },
-                        "required": ["locations"]
+                },
+                "required": ["coordinates"]
+            }
+        }
+    }
+]
+
+
+# /generate 回應快取：
+#   full  以正規化後的提示 + 模型 + 工具版本為鍵，快取整個最終回覆（命中時不呼叫模型）
+#   tools 只快取決定性的工具結果（工具名稱 + 參數），模型每次仍重新回答
+#   off   不快取
+GENERATE_CACHE_MODE = os.environ.get("GENERATE_CACHE_MODE", "full")
+GENERATE_TOOLS_VERSION = schema_version(GENERATE_SYSTEM_PROMPT, GENERATE_TOOLS)
+generate_cache = TTLCache(
+    max_entries=int(os.environ.get("GENERATE_CACHE_SIZE", 512)),
+    ttl=float(os.environ.get("GENERATE_CACHE_TTL", 3600)),
+)
+tool_result_cache = TTLCache(
+    max_entries=int(os.environ.get("TOOL_RESULT_CACHE_SIZE", 2048)),
+    ttl=float(os.environ.get("TOOL_RESULT_CACHE_TTL", 86400)),
+)
+
+
+def generate_cache_key(user_message):
+    return make_cache_key(normalize_prompt(user_message), GENERATE_MODEL, GENERATE_TOOLS_VERSION)
+
+
+def build_generate_messages(user_message):
+    return [
+        {"role": "system", "content": GENERATE_SYSTEM_PROMPT},
+        {"role": "user", "content": user_message},
+    ]
+
+
+class ToolCallError(Exception):
+    """工具呼叫參數有誤；status 為回給前端的 HTTP 狀態碼。"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_tool_arguments(raw_arguments):
+    try:
+        return json.loads(raw_arguments)
+    except Exception as ex:
+        raise ToolCallError('解析函式參數失敗: ' + str(ex), 500)
+
+
+def _geojson_reply(answer_text, geojson):
+    return (
+        f"{answer_text}\n\n"
+        "geojson ```\n"
+        f"{json.dumps(geojson, ensure_ascii=False, indent=2)}\n"
+        "```"
+    )
+
+
+def execute_tool_call(function_name, arguments, lookups=None):
+    """
+    執行模型要求的工具，回傳 (final_reply, geojson)：
+    final_reply 為回給前端的完整文字（內含 geojson 區塊），查無結果時 geojson 為 None。
+    lookups 見 resolve_locations。
+    """
+    if function_name == "get_multiple_buffer_polygons":
+        try:
+            locations = arguments["locations"]
+            if not isinstance(locations, list):
+                raise ToolCallError('locations 應為列表', 400)
+        except ToolCallError:
+            raise
+        except Exception as ex:
+            raise ToolCallError('解析 locations 失敗: ' + str(ex), 500)
+
+        geojson = get_multiple_buffer_polygons(locations, lookups)
+        if geojson:
+            answer_text = "以下為各地點對應的圓形範圍及中心點："
+        else:
+            answer_text = "找不到任何有效的地點資訊。"
+        return _geojson_reply(answer_text, geojson), geojson
+
+    elif function_name == "get_multiple_locations":
+        try:
+            place_names = arguments["place_names"]
+            if not isinstance(place_names, list):
+                raise ToolCallError('place_names 應為列表', 400)
+        except ToolCallError:
+            raise
+        except Exception as ex:
+            raise ToolCallError('解析 place_names 失敗: ' + str(ex), 500)
+
+        geojson = get_multiple_locations(place_names, lookups)
+        if geojson:
+            answer_text = f"您提到的地點分別為：{', '.join(place_names)}。以下為詳細資訊："
+        else:
+            answer_text = "找不到任何地點資訊。"
+        return _geojson_reply(answer_text, geojson), geojson
+
+    elif function_name == "get_buffer_polygon":
+        try:
+            radius = float(arguments["radius_km"])
+        except Exception as ex:
+            raise ToolCallError('半徑參數錯誤: ' + str(ex), 400)
+
+        geojson = get_buffer_polygon(arguments["place_name"], radius, lookups)
+        if geojson:
+            answer_text = f"以 {arguments['place_name']} 為中心、半徑 {radius} 公里的範圍及中心點如下："
+        else:
+            answer_text = f"找不到 {arguments['place_name']} 的相關資訊。"
+        return _geojson_reply(answer_text, geojson), geojson
+
+    elif function_name == "get_location_coordinates":
+        coordinates = resolve_locations([arguments["place_name"]], lookups)[0]
+        if not coordinates:
+            return f"找不到 {arguments['place_name']} 的相關資訊。", None
+        answer_text = f"地點：{arguments['place_name']}，經緯度：{coordinates}。"
+        geojson_point = {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "geometry": {
+                        "type": "Point",
+                        "coordinates": [coordinates["longitude"], coordinates["latitude"]]
+                    },
+                    "properties": {
+                        "name": arguments["place_name"]
                     }
                 }
-            },
+            ]
+        }
+        return _geojson_reply(answer_text, geojson_point), geojson_point
+
+    elif function_name == "get_polygon_from_coordinates":
+        try:
+            coords = arguments["coordinates"]
+            if not isinstance(coords, list):
+                raise ToolCallError('coordinates 應為列表', 400)
+        except ToolCallError:
+            raise
+        except Exception as ex:
+            raise ToolCallError('解析 coordinates 失敗: ' + str(ex), 500)
+
+        geojson = get_polygon_from_coordinates(coords)
+        if not geojson:
+            return "座標數量不足，無法形成多邊形。", None
+        return _geojson_reply("已依序連線下列座標並形成多邊形：", geojson), geojson
+
+    raise ToolCallError(f'不支援的函式: {function_name}', 500)
+
+
+# 回填給模型的工具結果摘要最多列出的 feature 數
+TOOL_SUMMARY_MAX_FEATURES = int(os.environ.get("TOOL_SUMMARY_MAX_FEATURES", 50))
+
+
+def summarize_geojson_for_model(geojson):
+    """
+    回填給模型的工具結果摘要：只列名稱、中心點座標、半徑與外框，不含多邊形的每個頂點。
+    完整幾何留在伺服器端，由 merge_geojson 合併後直接附在最終回覆，
+    避免每一步都把數十 KB 的座標重送給模型。
+    """
+    features = geojson.get("features", [])
+    summary = []
+    for feature in features[:TOOL_SUMMARY_MAX_FEATURES]:
+        properties = feature.get("properties") or {}
+        geometry = feature.get("geometry") or {}
+        item = {"name": properties.get("name"), "geometry": geometry.get("type")}
+        if geometry.get("type") == "Point":
+            item["coordinates"] = [round(c, 6) for c in geometry["coordinates"]]
+        elif geometry.get("type") == "Polygon":
+            ring = np.asarray(geometry["coordinates"][0], dtype=np.float64)
+            item["vertices"] = len(ring)
+            item["bbox"] = np.round(np.concatenate([ring.min(axis=0), ring.max(axis=0)]), 4).tolist()
+        if "radius_km" in properties:
+            item["radius_km"] = properties["radius_km"]
+        summary.append(item)
+    return {
+        "feature_count": len(features),
+        "features": summary,
+        "note": "完整 GeoJSON 已由系統附在最終回覆中，不需要重複輸出座標。",
+    }
+
+
+def run_tool_call_for_model(tool_call, lookups=None):
+    """
+    執行單一工具呼叫，回傳 (回填給模型的內容, geojson, 是否有地名查詢失敗)；
+    參數錯誤回填給模型而不中斷對話。查詢失敗或查無結果的工具結果不寫入 tool_result_cache。
+    """
+    try:
+        arguments = parse_tool_arguments(tool_call["arguments"])
+    except ToolCallError as ex:
+        return json.dumps({"error": str(ex)}, ensure_ascii=False), None, False
+
+    key = None
+    if GENERATE_CACHE_MODE == "tools":
+        key = make_cache_key(tool_call["name"], arguments, GENERATE_TOOLS_VERSION)
+        found, cached = tool_result_cache.get(key)
+        if found:
+            return cached
+
+    if lookups is None:
+        lookups = {}
+    try:
+        final_reply, geojson = execute_tool_call(tool_call["name"], arguments, lookups)
+    except ToolCallError as ex:
+        return json.dumps({"error": str(ex)}, ensure_ascii=False), None, False
+    lookup_failed = any(failed for _, failed in lookups.values())
+    if geojson is None:
+        return final_reply, None, lookup_failed
+    result = (
+        json.dumps(summarize_geojson_for_model(geojson), ensure_ascii=False, separators=(",", ":")),
+        geojson,
+        lookup_failed,
+    )
+    if key is not None and not lookup_failed:
+        tool_result_cache.put(key, result)
+    return result
+
+
+def append_tool_results(messages, tool_calls, results):
+    """
+    將 assistant 的 tool_calls 與各工具結果依序附加到 messages，
+    回傳 (與 tool_calls 同序的 geojson 列表, 是否有任何地名查詢失敗)。
+    """
+    messages.append({
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [
             {
+                "id": call["id"],
                 "type": "function",
-                "function": {
-                    "name": "get_polygon_from_coordinates",
-                    "description": "將多個經緯度點依順序連線為 GeoJSON Polygon",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "coordinates": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "latitude":  {"type": "number"},
-                                        "longitude": {"type": "number"}
-                                    },
-                                    "required": ["latitude", "longitude"]
-                                },
-                                "description": "按照連線順序排列的座標列表"
-                            }
-                        },
-                        "required": ["coordinates"]
-                    }
-                }
+                "function": {"name": call["name"], "arguments": call["arguments"]},
             }
-        ]
+            for call in tool_calls
+        ],
+    })
+    for call, (content, _, _) in zip(tool_calls, results):
+        messages.append({"role": "tool", "tool_call_id": call["id"], "content": content})
+    return [geojson for _, geojson, _ in results], any(failed for _, _, failed in results)
 
-        # ✅ 新版呼叫方式：client.chat.completions.create
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=messages,
-            tools=tools,
-            tool_choice="auto"
-        )
-
-        response_message = response.choices[0].message  # 物件，不是 dict
-
-        # ✅ 新版工具呼叫：tool_calls，而不是 function_call
-        if getattr(response_message, "tool_calls", None):
-            tool_call = response_message.tool_calls[0]
-            function_name = tool_call.function.name
-            try:
-                arguments = json.loads(tool_call.function.arguments)
-            except Exception as ex:
-                return jsonify({'error': '解析函式參數失敗: ' + str(ex)}), 500
-
-            # ===== 以下邏輯沿用你原本的分支，只是改用 function_name / arguments =====
-
-            if function_name == "get_multiple_buffer_polygons":
-                try:
-                    locations = arguments["locations"]
-                    if not isinstance(locations, list):
-                        return jsonify({'error': 'locations 應為列表'}), 400
-                except Exception as ex:
-                    return jsonify({'error': '解析 locations 失敗: ' + str(ex)}), 500
-
-                geojson = get_multiple_buffer_polygons(locations)
-                if geojson:
-                    answer_text = "以下為各地點對應的圓形範圍及中心點："
-                else:
-                    answer_text = "找不到任何有效的地點資訊。"
-                final_reply = (
-                    f"{answer_text}\n\n"
-                    "geojson ```\n"
-                    f"{json.dumps(geojson, ensure_ascii=False, indent=2)}\n"
-                    "```"
-                )
-                return jsonify({'response': final_reply}), 200
-
-            elif function_name == "get_multiple_locations":
-                try:
-                    place_names = arguments["place_names"]
-                    if not isinstance(place_names, list):
-                        return jsonify({'error': 'place_names 應為列表'}), 400
-                except Exception as ex:
-                    return jsonify({'error': '解析 place_names 失敗: ' + str(ex)}), 500
-
-                geojson = get_multiple_locations(place_names)
-                if geojson:
-                    answer_text = f"您提到的地點分別為：{', '.join(place_names)}。以下為詳細資訊："
-                else:
-                    answer_text = "找不到任何地點資訊。"
-                final_reply = (
-                    f"{answer_text}\n\n"
-                    "geojson ```\n"
-                    f"{json.dumps(geojson, ensure_ascii=False, indent=2)}\n"
-                    "```"
-                )
-                return jsonify({'response': final_reply}), 200
-
-            elif function_name == "get_buffer_polygon":
-                try:
-                    radius = float(arguments["radius_km"])
-                except Exception as ex:
-                    return jsonify({'error': '半徑參數錯誤: ' + str(ex)}), 400
-
-                geojson = get_buffer_polygon(arguments["place_name"], radius)
-                if geojson:
-                    answer_text = f"以 {arguments['place_name']} 為中心、半徑 {radius} 公里的範圍及中心點如下："
-                else:
-                    answer_text = f"找不到 {arguments['place_name']} 的相關資訊。"
-                final_reply = (
-                    f"{answer_text}\n\n"
-                    "geojson ```\n"
-                    f"{json.dumps(geojson, ensure_ascii=False, indent=2)}\n"
-                    "```"
-                )
-                return jsonify({'response': final_reply}), 200
-
-            elif function_name == "get_location_coordinates":
-                coordinates = get_location_coordinates(arguments["place_name"])
-                if coordinates:
-                    answer_text = f"地點：{arguments['place_name']}，經緯度：{coordinates}。"
-                    geojson_point = {
-                        "type": "FeatureCollection",
-                        "features": [
-                            {
-                                "type": "Feature",
-                                "geometry": {
-                                    "type": "Point",
-                                    "coordinates": [coordinates["longitude"], coordinates["latitude"]]
-                                },
-                                "properties": {
-                                    "name": arguments["place_name"]
-                                }
-                            }
-                        ]
-                    }
-                    final_reply = (
-                        f"{answer_text}\n\n"
-                        "geojson ```\n"
-                        f"{json.dumps(geojson_point, ensure_ascii=False, indent=2)}\n"
-                        "```"
-                    )
-                else:
-                    final_reply = f"找不到 {arguments['place_name']} 的相關資訊。"
-                return jsonify({'response': final_reply}), 200
-
-            elif function_name == "get_polygon_from_coordinates":
-                try:
-                    coords = arguments["coordinates"]
-                    if not isinstance(coords, list):
-                        return jsonify({'error': 'coordinates 應為列表'}), 400
-                except Exception as ex:
-                    return jsonify({'error': '解析 coordinates 失敗: ' + str(ex)}), 500
-
-                geojson = get_polygon_from_coordinates(coords)
-                if geojson:
-                    final_reply = (
-                        "已依序連線下列座標並形成多邊形：\n\n"
-                        "geojson ```\n"
-                        f"{json.dumps(geojson, ensure_ascii=False, indent=2)}\n"
-                        "```"
-                    )
-                else:
-                    final_reply = "座標數量不足，無法形成多邊形。"
-                return jsonify({'response': final_reply}), 200
 
-        else:
-            # ✅ 注意：新版 message 是物件，要用 .content
-            return jsonify({'response': response_message.content}), 200
+def run_tool_calls(messages, tool_calls):
+    """
+    同時執行同一輪的所有工具呼叫並將結果附加到 messages（見 append_tool_results）。
+    tool_calls 為 [{"id", "name", "arguments"}, ...]。
+    """
+    if len(tool_calls) == 1:
+        results = [run_tool_call_for_model(tool_calls[0])]
+    else:
+        results = list(tool_executor.map(run_tool_call_for_model, tool_calls))
+    return append_tool_results(messages, tool_calls, results)
+
+
+def tool_place_names(function_name, arguments):
+    """工具參數中需要查詢座標的地名，供非同步路徑預先查詢。"""
+    try:
+        if function_name in ("get_location_coordinates", "get_buffer_polygon"):
+            return [arguments["place_name"]]
+        if function_name == "get_multiple_locations":
+            return list(arguments["place_names"])
+        if function_name == "get_multiple_buffer_polygons":
+            return [loc["place_name"] for loc in arguments["locations"]]
+    except (KeyError, TypeError):
+        pass
+    return []
+
+
+def merge_geojson(geojsons):
+    """將多個工具結果的 FeatureCollection 合併成一個；沒有任何結果時回傳 None。"""
+    features = []
+    for geojson in geojsons:
+        if geojson:
+            features.extend(geojson.get("features", []))
+    if not features:
+        return None
+    return {"type": "FeatureCollection", "features": features}
+
+
+def finalize_reply(content, geojsons):
+    """
+    組成最終回覆，回傳 (文字, 合併後的單一 FeatureCollection 或 None)。
+    有工具結果時移除模型自行撰寫的 geojson 區塊，前端只會解析第一個區塊。
+    """
+    merged = merge_geojson(geojsons)
+    content = content or ""
+    if merged is None:
+        return content, None
+    content = re.sub(r"geojson\s*```[^`]*```", "", content).strip()
+    return content or "以下為查詢結果：", merged
+
+
+# format=structured 時 geojson 座標預設保留的小數位數
+GEOJSON_PRECISION = parse_precision(os.environ.get("GEOJSON_PRECISION"), DEFAULT_PRECISION)
+
+
+def parse_response_format(data, args):
+    """
+    回應格式由 body 或 query string 的 format / precision 指定，回傳 (是否 structured, 座標精度)。
+    預設沿用文字內嵌 geojson 區塊的格式。
+    """
+    response_format = data.get('format') or args.get('format')
+    precision = parse_precision(data.get('precision', args.get('precision')), GEOJSON_PRECISION)
+    return response_format == 'structured', precision
+
+
+def render_reply(reply, structured, precision):
+    """
+    reply 為 finalize_reply 的 (文字, geojson)：
+      預設        {"response": 文字 + 縮排的 geojson 區塊}
+      structured  {"response": 文字, "geojson": 座標取 precision 位小數的 geojson}
+    """
+    text, geojson = reply
+    if not structured:
+        return {'response': text if geojson is None else _geojson_reply(text, geojson)}
+    return {'response': text, 'geojson': round_geojson(geojson, precision) if geojson is not None else None}
+
+
+def tool_choice_for_step(step):
+    return "none" if step == GENERATE_MAX_STEPS - 1 else "auto"
+
+
+@app.route('/generate', methods=['POST'])
+def generate_text():
+    try:
+        data = request.get_json()
+        user_message = data.get('prompt', '')
+        if not user_message:
+            return jsonify({'error': '訊息為必填'}), 400
+        structured, precision = parse_response_format(data, request.args)
+
+        def respond(reply, cache_status):
+            body = render_reply(reply, structured, precision)
+            if structured:
+                # 精簡編碼（無縮排、orjson），前端直接讀 geojson 欄位不需再解析文字
+                return Response(dumps_compact(body), mimetype='application/json', headers={'X-Cache': cache_status})
+            return jsonify(body), 200, {'X-Cache': cache_status}
+
+        cache_key = generate_cache_key(user_message)
+        if GENERATE_CACHE_MODE == "full":
+            found, cached = generate_cache.get(cache_key)
+            if found:
+                return respond(cached, 'HIT')
+
+        messages = build_generate_messages(user_message)
+        geojsons = []
+        lookup_failed = False
+        for step in range(GENERATE_MAX_STEPS):
+            # ✅ 新版呼叫方式：client.chat.completions.create
+            response = client.chat.completions.create(
+                model=GENERATE_MODEL,
+                messages=messages,
+                tools=GENERATE_TOOLS,
+                tool_choice=tool_choice_for_step(step)
+            )
+            response_message = response.choices[0].message  # 物件，不是 dict
+
+            # ✅ 新版工具呼叫：tool_calls；同一輪的所有呼叫都執行並回填給模型
+            tool_calls = [
+                {"id": tc.id, "name": tc.function.name, "arguments": tc.function.arguments}
+                for tc in getattr(response_message, "tool_calls", None) or []
+            ]
+            if not tool_calls:
+                break
+            step_geojsons, step_failed = run_tool_calls(messages, tool_calls)
+            geojsons.extend(step_geojsons)
+            lookup_failed = lookup_failed or step_failed
+
+        # ✅ 注意：新版 message 是物件，要用 .content
+        final_reply = finalize_reply(response_message.content, geojsons)
+        # 地名查詢暫時失敗時的回覆不快取，服務恢復後同一提示會重新查詢
+        if GENERATE_CACHE_MODE == "full" and not lookup_failed:
+            generate_cache.put(cache_key, final_reply)
+        return respond(final_reply, 'MISS')
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {dumps_compact(data)}\n\n"
+
+
+def stream_chat_completion(messages, tool_choice="auto"):
+    """
+    以 stream=True 呼叫 chat completion：文字片段一到就 yield ("token", 文字)，
+    串流結束後若模型要求呼叫工具，再 yield ("tool_calls", [{"id", "name", "arguments"}, ...])。
+    """
+    stream = client.chat.completions.create(
+        model=GENERATE_MODEL,
+        messages=messages,
+        tools=GENERATE_TOOLS,
+        tool_choice=tool_choice,
+        stream=True,
+    )
+    tool_calls = {}  # index -> 逐段拼接中的工具呼叫
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            yield "token", delta.content
+        accumulate_tool_call_deltas(tool_calls, delta)
+    if tool_calls:
+        yield "tool_calls", [tool_calls[i] for i in sorted(tool_calls)]
+
+
+def accumulate_tool_call_deltas(tool_calls, delta):
+    """串流時工具呼叫的名稱與參數會分段送達，依 index 拼接到 tool_calls。"""
+    for tool_call in delta.tool_calls or []:
+        entry = tool_calls.setdefault(tool_call.index, {"id": None, "name": "", "arguments": ""})
+        if tool_call.id:
+            entry["id"] = tool_call.id
+        if tool_call.function is not None:
+            entry["name"] += tool_call.function.name or ""
+            entry["arguments"] += tool_call.function.arguments or ""
+
+
+@app.route('/generate/stream', methods=['POST'])
+def generate_text_stream():
+    """
+    /generate 的 Server-Sent Events 版本，請求格式相同，依序送出：
+      token    模型產生的文字片段 {"text": ...}
+      geojson  每個工具查詢結果 {"tool": 函式名稱, "geojson": ...}
+      done     完整回覆，內容與 /generate 的回應相同（含 format=structured 時的 geojson 欄位）
+      error    {"error": ..., "status": ...}
+    """
+    data = request.get_json(silent=True) or {}
+    user_message = data.get('prompt', '')
+    if not user_message:
+        return jsonify({'error': '訊息為必填'}), 400
+    structured, precision = parse_response_format(data, request.args)
+
+    cache_key = generate_cache_key(user_message)
+
+    def events():
+        try:
+            if GENERATE_CACHE_MODE == "full":
+                found, cached = generate_cache.get(cache_key)
+                if found:
+                    yield sse_event("done", dict(render_reply(cached, structured, precision), cached=True))
+                    return
+
+            messages = build_generate_messages(user_message)
+            geojsons = []
+            lookup_failed = False
+            for step in range(GENERATE_MAX_STEPS):
+                content = []
+                tool_calls = []
+                for kind, payload in stream_chat_completion(messages, tool_choice_for_step(step)):
+                    if kind == "token":
+                        content.append(payload)
+                        yield sse_event("token", {"text": payload})
+                    else:
+                        tool_calls = payload
+                if not tool_calls:
+                    break
+                step_geojsons, step_failed = run_tool_calls(messages, tool_calls)
+                lookup_failed = lookup_failed or step_failed
+                for tool_call, geojson in zip(tool_calls, step_geojsons):
+                    if geojson is not None:
+                        if structured:
+                            geojson = round_geojson(geojson, precision)
+                        yield sse_event("geojson", {"tool": tool_call["name"], "geojson": geojson})
+                geojsons.extend(step_geojsons)
+            final_reply = finalize_reply("".join(content), geojsons)
+            if GENERATE_CACHE_MODE == "full" and not lookup_failed:
+                generate_cache.put(cache_key, final_reply)
+            yield sse_event("done", render_reply(final_reply, structured, precision))
+        except Exception as ex:
+            yield sse_event("error", {"error": str(ex), "status": 500})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        # 關閉快取與反向代理緩衝，確保每個事件立即送達
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route('/generate/cache_stats', methods=['GET'])
+def generate_cache_stats():
+    """回應快取與工具結果快取的命中統計。"""
+    return jsonify({
+        'mode': GENERATE_CACHE_MODE,
+        'tools_version': GENERATE_TOOLS_VERSION,
+        'responses': generate_cache.stats(),
+        'tool_results': tool_result_cache.stats(),
+        'geocode': {'hits': geocode_cache.hits, 'misses': geocode_cache.misses},
+        'gazetteer': {'entries': len(gazetteer) if gazetteer is not None else 0, 'offline': GEOCODE_OFFLINE},
+    }), 200
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=80)
@@ -0,0 +1,287 @@
+"""
+/generate 與 /generate/stream 的 asyncio 服務路徑（ASGI）。
+
+等待 OpenAI 與 Google Places 回應時不佔用執行緒，單一行程即可同時服務大量對話；
+請求與回應格式與 Flask 版本相同，其餘路徑（/analyze、警戒區 API、靜態檔）仍交給原本的 Flask app。
+
+    uvicorn asgi:application --host 0.0.0.0 --port 80
+"""
+import asyncio
+import json
+import os
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from openai import AsyncOpenAI
+
+import app as server
+from geocode_cache import normalize_place_name
+from geojson_codec import dumps_compact, round_geojson
+from http_client import AsyncHttpClient
+
+async_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+# 與同步路徑共用 timeout、重試設定與斷路器狀態
+places_client = AsyncHttpClient(
+    server.places_client.base_url,
+    timeout=server.places_client.timeout,
+    max_retries=server.places_client.max_retries,
+    pool_size=int(os.environ.get("ASYNC_GEO_POOL_SIZE", 100)),
+    breaker=server.places_client.breaker,
+)
+
+wsgi_application = WsgiToAsgi(server.app)
+
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+
+_inflight = {}  # 正規化地名 -> 查詢中的 Task，同一地名同時只送出一個請求
+
+
+# --------------------- 非同步地名查詢 ---------------------
+async def _fetch_location(place_name):
+    """回傳 (座標或 None, 是否因暫時性失敗而查不到)，與 app.lookup_location 相同。"""
+    try:
+        data = await places_client.get_json(server.PLACES_FIND_PATH, params=server.places_find_params(place_name))
+    except Exception as ex:
+        server.report_places_error(place_name, ex)
+        return server.gazetteer_lookup(place_name, approximate=True), True
+    # 寫入 SQLite 快取會 commit，交給執行緒避免卡住 event loop
+    coordinates = await asyncio.to_thread(server.store_places_result, place_name, data)
+    if coordinates is not None:
+        return coordinates, False
+    return server.gazetteer_lookup(place_name, approximate=True), server.places_lookup_failed(data)
+
+
+async def lookup_location(place_name):
+    # 座標快取在記憶體未命中時會讀 SQLite，交給執行緒避免卡住 event loop
+    found, cached = await asyncio.to_thread(server.lookup_local_coordinates, place_name)
+    if found:
+        return cached, False
+    key = normalize_place_name(place_name)
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_location(place_name))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield：單一請求被取消時不影響其他等待同一地名的請求
+    return await asyncio.shield(task)
+
+
+async def run_tool_call(tool_call):
+    """
+    先以非同步方式查好工具需要的地名座標（含失敗結果），再連同查詢結果交給執行緒完成工具計算，
+    執行緒內不會再送出 Places 請求。
+    """
+    try:
+        arguments = server.parse_tool_arguments(tool_call["arguments"])
+    except server.ToolCallError:
+        arguments = None
+    lookups = {}
+    if arguments is not None:
+        names = {normalize_place_name(n): n for n in server.tool_place_names(tool_call["name"], arguments)}
+        results = await asyncio.gather(*(lookup_location(n) for n in names.values()))
+        lookups = dict(zip(names, results))
+    return await asyncio.to_thread(server.run_tool_call_for_model, tool_call, lookups)
+
+
+async def run_tool_calls(messages, tool_calls):
+    results = await asyncio.gather(*(run_tool_call(call) for call in tool_calls))
+    return server.append_tool_results(messages, tool_calls, results)
+
+
+# --------------------- /generate ---------------------
+async def generate_reply(user_message):
+    """回傳 (finalize_reply 的 (文字, geojson), 是否命中快取)，流程與 app.generate_text 相同。"""
+    cache_key = server.generate_cache_key(user_message)
+    if server.GENERATE_CACHE_MODE == "full":
+        found, cached = server.generate_cache.get(cache_key)
+        if found:
+            return cached, True
+
+    messages = server.build_generate_messages(user_message)
+    geojsons = []
+    lookup_failed = False
+    for step in range(server.GENERATE_MAX_STEPS):
+        response = await async_client.chat.completions.create(
+            model=server.GENERATE_MODEL,
+            messages=messages,
+            tools=server.GENERATE_TOOLS,
+            tool_choice=server.tool_choice_for_step(step),
+        )
+        response_message = response.choices[0].message
+        tool_calls = [
+            {"id": tc.id, "name": tc.function.name, "arguments": tc.function.arguments}
+            for tc in getattr(response_message, "tool_calls", None) or []
+        ]
+        if not tool_calls:
+            break
+        step_geojsons, step_failed = await run_tool_calls(messages, tool_calls)
+        geojsons.extend(step_geojsons)
+        lookup_failed = lookup_failed or step_failed
+
+    final_reply = server.finalize_reply(response_message.content, geojsons)
+    # 地名查詢暫時失敗時的回覆不快取
+    if server.GENERATE_CACHE_MODE == "full" and not lookup_failed:
+        server.generate_cache.put(cache_key, final_reply)
+    return final_reply, False
+
+
+async def stream_chat_completion(messages, tool_choice):
+    stream = await async_client.chat.completions.create(
+        model=server.GENERATE_MODEL,
+        messages=messages,
+        tools=server.GENERATE_TOOLS,
+        tool_choice=tool_choice,
+        stream=True,
+    )
+    tool_calls = {}
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            yield "token", delta.content
+        server.accumulate_tool_call_deltas(tool_calls, delta)
+    if tool_calls:
+        yield "tool_calls", [tool_calls[i] for i in sorted(tool_calls)]
+
+
+async def generate_events(user_message, structured, precision):
+    """事件種類與 app.generate_text_stream 相同。"""
+    try:
+        cache_key = server.generate_cache_key(user_message)
+        if server.GENERATE_CACHE_MODE == "full":
+            found, cached = server.generate_cache.get(cache_key)
+            if found:
+                yield server.sse_event("done", dict(server.render_reply(cached, structured, precision), cached=True))
+                return
+
+        messages = server.build_generate_messages(user_message)
+        geojsons = []
+        lookup_failed = False
+        for step in range(server.GENERATE_MAX_STEPS):
+            content = []
+            tool_calls = []
+            async for kind, payload in stream_chat_completion(messages, server.tool_choice_for_step(step)):
+                if kind == "token":
+                    content.append(payload)
+                    yield server.sse_event("token", {"text": payload})
+                else:
+                    tool_calls = payload
+            if not tool_calls:
+                break
+            step_geojsons, step_failed = await run_tool_calls(messages, tool_calls)
+            lookup_failed = lookup_failed or step_failed
+            for tool_call, geojson in zip(tool_calls, step_geojsons):
+                if geojson is not None:
+                    if structured:
+                        geojson = round_geojson(geojson, precision)
+                    yield server.sse_event("geojson", {"tool": tool_call["name"], "geojson": geojson})
+            geojsons.extend(step_geojsons)
+        final_reply = server.finalize_reply("".join(content), geojsons)
+        if server.GENERATE_CACHE_MODE == "full" and not lookup_failed:
+            server.generate_cache.put(cache_key, final_reply)
+        yield server.sse_event("done", server.render_reply(final_reply, structured, precision))
+    except Exception as ex:
+        yield server.sse_event("error", {"error": str(ex), "status": 500})
+
+
+# --------------------- ASGI 介面 ---------------------
+async def _read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return json.loads(body) if body else None
+
+
+def _query_args(scope):
+    return dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+
+
+async def _send_json(send, status, payload, headers=(), compact=False):
+    body = (dumps_compact(payload) if compact else json.dumps(payload)).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *CORS_HEADERS,
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def handle_generate(scope, receive, send):
+    try:
+        data = await _read_json(receive)
+        user_message = data.get('prompt', '')
+        if not user_message:
+            await _send_json(send, 400, {'error': '訊息為必填'})
+            return
+        structured, precision = server.parse_response_format(data, _query_args(scope))
+        final_reply, cached = await generate_reply(user_message)
+    except Exception as e:
+        await _send_json(send, 500, {'error': str(e)})
+        return
+    await _send_json(
+        send, 200, server.render_reply(final_reply, structured, precision),
+        [(b"x-cache", b"HIT" if cached else b"MISS")], compact=structured,
+    )
+
+
+async def handle_generate_stream(scope, receive, send):
+    try:
+        data = await _read_json(receive) or {}
+    except ValueError:
+        data = {}
+    user_message = data.get('prompt', '') if isinstance(data, dict) else ''
+    if not user_message:
+        await _send_json(send, 400, {'error': '訊息為必填'})
+        return
+    structured, precision = server.parse_response_format(data, _query_args(scope))
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+            *CORS_HEADERS,
+        ],
+    })
+    async for event in generate_events(user_message, structured, precision):
+        await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+ROUTES = {
+    "/generate": handle_generate,
+    "/generate/stream": handle_generate_stream,
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await places_client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in ROUTES:
+        await ROUTES[scope["path"]](scope, receive, send)
+        return
+    await wsgi_application(scope, receive, send)
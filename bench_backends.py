@@ -0,0 +1,147 @@
+"""
+比較 torch 與 onnx 推理後端在相同 tile 上的延遲與輸出一致性。
+
+    python bench_backends.py --weights yolo11n-obb.pt --images samples/ --batch 8 --output bench_backends.json
+
+未指定 --images 時使用隨機雜訊 tile，只適合比較延遲。
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from inference_backends import create_backend
+from obb_utils import obb_corners, rotated_iou
+from tiling import iter_tile_boxes
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+
+
+def load_tiles(images_dir, tile_size, max_tiles):
+    tiles = []
+    for name in sorted(os.listdir(images_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        image = Image.open(os.path.join(images_dir, name)).convert("RGB")
+        for box in iter_tile_boxes(image.width, image.height, tile_size, 0):
+            tiles.append(np.array(image.crop(box)))
+            if len(tiles) >= max_tiles:
+                return tiles
+    return tiles
+
+
+def synthetic_tiles(tile_size, count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, (tile_size, tile_size, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def time_backend(backend, tiles, batch_size, repeat):
+    """回傳每批延遲（毫秒）與最後一次執行的輸出。"""
+    backend.warmup()
+    latencies = []
+    outputs = []
+    for _ in range(repeat):
+        outputs = []
+        for start in range(0, len(tiles), batch_size):
+            batch = tiles[start:start + batch_size]
+            t0 = time.perf_counter()
+            outputs.extend(backend(batch))
+            latencies.append((time.perf_counter() - t0) * 1000)
+    return latencies, outputs
+
+
+def summarize_latency(latencies, tiles_per_run, repeat):
+    ordered = sorted(latencies)
+    total_s = sum(latencies) / 1000
+    return {
+        "batches": len(latencies),
+        "mean_ms": statistics.fmean(latencies),
+        "p50_ms": ordered[len(ordered) // 2],
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "tiles_per_sec": tiles_per_run * repeat / total_s if total_s else None,
+    }
+
+
+def compare_outputs(reference, candidate, iou_threshold):
+    """以 reference（torch）為基準，逐 tile 依同類別旋轉 IoU 貪婪配對。"""
+    matched = ref_total = cand_total = 0
+    conf_diffs = []
+    center_offsets = []
+    for ref, cand in zip(reference, candidate):
+        ref_total += len(ref)
+        cand_total += len(cand)
+        if not len(ref) or not len(cand):
+            continue
+        ref_corners = obb_corners(ref[:, :5])
+        cand_corners = obb_corners(cand[:, :5])
+        i, j = np.meshgrid(np.arange(len(ref)), np.arange(len(cand)), indexing="ij")
+        i, j = i.ravel(), j.ravel()
+        iou = rotated_iou(ref_corners[i], cand_corners[j])
+        iou[ref[i, 6] != cand[j, 6]] = 0
+        used_ref, used_cand = set(), set()
+        for k in np.argsort(-iou):
+            if iou[k] < iou_threshold:
+                break
+            if i[k] in used_ref or j[k] in used_cand:
+                continue
+            used_ref.add(i[k])
+            used_cand.add(j[k])
+            matched += 1
+            conf_diffs.append(abs(float(ref[i[k], 5] - cand[j[k], 5])))
+            center_offsets.append(float(np.hypot(*(ref[i[k], :2] - cand[j[k], :2]))))
+    return {
+        "reference_boxes": ref_total,
+        "candidate_boxes": cand_total,
+        "matched": matched,
+        "recall": matched / ref_total if ref_total else None,
+        "precision": matched / cand_total if cand_total else None,
+        "mean_abs_conf_diff": statistics.fmean(conf_diffs) if conf_diffs else None,
+        "mean_center_offset_px": statistics.fmean(center_offsets) if center_offsets else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="torch / onnx 推理後端基準測試")
+    parser.add_argument("--weights", default="yolo11n-obb.pt")
+    parser.add_argument("--images", help="影像資料夾；未指定時使用隨機 tile")
+    parser.add_argument("--tile-size", type=int, default=1024)
+    parser.add_argument("--max-tiles", type=int, default=32)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--iou", type=float, default=0.5, help="視為同一偵測的旋轉 IoU 門檻")
+    parser.add_argument("--output", help="將報告寫入 JSON 檔")
+    args = parser.parse_args()
+
+    if args.images:
+        tiles = load_tiles(args.images, args.tile_size, args.max_tiles)
+    else:
+        print("未指定 --images，使用隨機 tile（僅供比較延遲）")
+        tiles = synthetic_tiles(args.tile_size, args.max_tiles)
+
+    report = {
+        "weights": args.weights,
+        "tiles": len(tiles),
+        "tile_size": args.tile_size,
+        "batch": args.batch,
+        "repeat": args.repeat,
+        "backends": {},
+    }
+    outputs = {}
+    for name in ("torch", "onnx"):
+        backend = create_backend(name, args.weights)
+        latencies, outputs[name] = time_backend(backend, tiles, args.batch, args.repeat)
+        report["backends"][name] = summarize_latency(latencies, len(tiles), args.repeat)
+    report["onnx_vs_torch"] = compare_outputs(outputs["torch"], outputs["onnx"], args.iou)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+/analyze 偵測流程的分段基準測試，使用固定輸出的 stub 模型，可離線執行。
+
+    python bench_detect.py --sizes 1024,4096,10000,20000 --output bench_detect.json
+    python bench_detect.py --compare bench_detect_old.json
+    python bench_detect.py --check-tiling
+
+各尺寸分別計時：decode、split_image_into_tiles、inference、postprocess（含 NMS 與序列化）、
+draw、jpeg_encode，並輸出可在版本間比對的 JSON 報告。
+TIFF 走視窗解碼時，解碼發生在切 tile 與繪圖底圖產生時，分別計入那兩個階段。
+--check-tiling 另外檢查多 strip 與 tiled TIFF 的視窗解碼結果與整張解碼一致。
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import struct
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows 沒有 resource 模組，峰值記憶體改記為 None
+    resource = None
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+
+from detection import (
+    ALLOWED_CLASSES,
+    CONF_THRESHOLD,
+    NMS_IOU_THRESHOLD,
+    TILE_OVERLAP,
+    TILE_SIZE,
+    draw_obb_bboxes,
+    merge_overlapping_obbs,
+    split_image_into_tiles,
+)
+from obb_utils import allowed_class_ids, obbs_to_bboxes, postprocess_obb_batch
+from tiling import ImageTooLargeError, TiledImageReader
+
+STAGES = ("decode", "split_image_into_tiles", "inference", "postprocess", "draw", "jpeg_encode")
+
+# 與 DOTA 類別順序相同的名稱，讓 ALLOWED_CLASSES 過濾能實際作用
+STUB_NAMES = {
+    0: "plane", 1: "ship", 2: "storage tank", 3: "baseball diamond", 4: "tennis court",
+    5: "basketball court", 6: "ground track field", 7: "harbor", 8: "bridge",
+    9: "large vehicle", 10: "small vehicle", 11: "helicopter", 12: "roundabout",
+    13: "soccer ball field", 14: "swimming pool",
+}
+
+
+class StubObbModel:
+    """
+    決定性的 stub 模型：依 tile 內容產生固定數量的 OBB，
+    同一張 tile 每次輸出都相同，不需要權重檔或 torch。
+    """
+
+    names = STUB_NAMES
+
+    def __init__(self, boxes_per_tile=50, latency_ms=0.0):
+        self.boxes_per_tile = boxes_per_tile
+        self.latency_ms = latency_ms
+
+    def __call__(self, batch):
+        outputs = []
+        for tile in batch:
+            h, w = tile.shape[:2]
+            seed = int(tile[::97, ::89].sum()) + h * 31 + w
+            rng = np.random.default_rng(seed)
+            n = self.boxes_per_tile
+            outputs.append(np.stack([
+                rng.uniform(0, w, n),
+                rng.uniform(0, h, n),
+                rng.uniform(8, 80, n),
+                rng.uniform(4, 30, n),
+                rng.uniform(0, np.pi, n),
+                rng.uniform(0.05, 1.0, n),
+                rng.integers(0, len(self.names), n),
+            ], axis=1).astype(np.float32))
+        if self.latency_ms:
+            time.sleep(self.latency_ms * len(batch) / 1000)
+        return outputs
+
+
+def make_synthetic_image(size, image_format, seed=0):
+    """產生 size×size 的合成影像並編碼成指定格式，回傳位元組。"""
+    rng = np.random.default_rng(seed)
+    image = Image.new("RGB", (size, size), (18, 52, 86))
+    draw = ImageDraw.Draw(image)
+    # 以少量矩形模擬船隻/建物，保持編碼後檔案不致過大
+    for _ in range(max(10, size * size // 200_000)):
+        x, y = rng.integers(0, size, 2)
+        w, h = rng.integers(4, 60, 2)
+        draw.rectangle([int(x), int(y), int(x + w), int(y + h)], fill=tuple(int(c) for c in rng.integers(0, 256, 3)))
+    buffer = io.BytesIO()
+    image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def encode_raw_tiff(image, rows_per_strip=None, tile_size=None):
+    """
+    將 RGB 影像寫成未壓縮 TIFF（Pillow 10 寫不出多 strip，也一律寫不出 tiled）：
+    指定 tile_size 時為 tile_size×tile_size 的 tiled TIFF（超出影像的部分補零），
+    否則每 rows_per_strip 列一個 strip（None 為單一 strip）。
+    """
+    pixels = np.asarray(image.convert("RGB"))
+    height, width = pixels.shape[:2]
+    blocks = []
+    if tile_size:
+        for top in range(0, height, tile_size):
+            for left in range(0, width, tile_size):
+                tile = np.zeros((tile_size, tile_size, 3), dtype=np.uint8)
+                block = pixels[top:top + tile_size, left:left + tile_size]
+                tile[:block.shape[0], :block.shape[1]] = block
+                blocks.append(tile.tobytes())
+    else:
+        rows_per_strip = rows_per_strip or height
+        blocks = [pixels[top:top + rows_per_strip].tobytes() for top in range(0, height, rows_per_strip)]
+
+    data_offset = 8
+    offsets = []
+    for block in blocks:
+        offsets.append(data_offset)
+        data_offset += len(block)
+    bits_offset = data_offset
+    offsets_offset = bits_offset + 6
+    counts_offset = offsets_offset + 4 * len(blocks)
+    ifd_offset = counts_offset + 4 * len(blocks)
+    # (tag, type, count, value)；type 3 = SHORT、4 = LONG，依 tag 排序
+    entries = [
+        (256, 4, 1, width),
+        (257, 4, 1, height),
+        (258, 3, 3, bits_offset),
+        (259, 3, 1, 1),
+        (262, 3, 1, 2),
+        (277, 3, 1, 3),
+        (284, 3, 1, 1),
+    ]
+    # 只有一個區塊時，位移與長度直接放在 IFD 欄位內而非指向陣列
+    offsets_value = offsets[0] if len(blocks) == 1 else offsets_offset
+    counts_value = len(blocks[0]) if len(blocks) == 1 else counts_offset
+    if tile_size:
+        entries += [
+            (322, 4, 1, tile_size),
+            (323, 4, 1, tile_size),
+            (324, 4, len(blocks), offsets_value),
+            (325, 4, len(blocks), counts_value),
+        ]
+    else:
+        entries += [
+            (273, 4, len(blocks), offsets_value),
+            (278, 4, 1, rows_per_strip),
+            (279, 4, len(blocks), counts_value),
+        ]
+    entries.sort()
+    buffer = io.BytesIO()
+    buffer.write(b"II*\x00" + struct.pack("<I", ifd_offset))
+    for block in blocks:
+        buffer.write(block)
+    buffer.write(struct.pack("<3H", 8, 8, 8))
+    buffer.write(struct.pack(f"<{len(blocks)}I", *offsets))
+    buffer.write(struct.pack(f"<{len(blocks)}I", *(len(b) for b in blocks)))
+    buffer.write(struct.pack("<H", len(entries)))
+    for tag, kind, count, value in entries:
+        if kind == 3 and count == 1:
+            buffer.write(struct.pack("<HHIHH", tag, kind, count, value, 0))
+        else:
+            buffer.write(struct.pack("<HHII", tag, kind, count, value))
+    buffer.write(struct.pack("<I", 0))
+    return buffer.getvalue()
+
+
+def check_tiling(width=1000, height=700, tile_size=256, overlap=64):
+    """
+    視窗解碼的回歸檢查：單一 strip、多 strip 與 tiled 三種未壓縮 TIFF，
+    iter_tiles 的每個 tile 與 render_base 都必須與整張解碼後 crop 的結果相同。回傳失敗項目列表。
+    """
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+    layouts = {
+        "single-strip": encode_raw_tiff(image),
+        "multi-strip": encode_raw_tiff(image, rows_per_strip=64),
+        "tiled": encode_raw_tiff(image, tile_size=tile_size),
+    }
+
+    expected = np.asarray(image)
+    failures = []
+    for name, data in layouts.items():
+        before = len(failures)
+        reader = TiledImageReader(io.BytesIO(data))
+        try:
+            if reader.strategy != "window":
+                failures.append(f"{name}: 未使用視窗解碼（{reader.strategy}）")
+                continue
+            for tile, left, top in reader.iter_tiles(tile_size, overlap):
+                crop = expected[top:top + tile.size[1], left:left + tile.size[0]]
+                if not np.array_equal(np.asarray(tile), crop):
+                    failures.append(f"{name}: tile ({left}, {top}) 與整張解碼不同")
+                    break
+            base, scale = reader.render_base()
+            if scale != 1.0 or not np.array_equal(np.asarray(base), expected):
+                failures.append(f"{name}: render_base 與整張解碼不同")
+        except Exception as ex:
+            failures.append(f"{name}: {type(ex).__name__}: {ex}")
+        finally:
+            reader.close()
+        print(f"{name}: {len(data)} bytes, {'OK' if len(failures) == before else 'FAILED'}")
+    return failures
+
+
+def run_once(data, model):
+    timings = {}
+
+    t0 = time.perf_counter()
+    reader = TiledImageReader(io.BytesIO(data))
+    timings["decode"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if reader.strategy == "window":
+        # 視窗解碼模式下解碼與切 tile 同時發生，都計入此階段
+        tiles = list(reader.iter_tiles(TILE_SIZE, TILE_OVERLAP))
+    else:
+        decoded, _ = reader.render_base()
+        tiles = split_image_into_tiles(decoded, TILE_SIZE, TILE_OVERLAP)
+    timings["split_image_into_tiles"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batch = [np.asarray(tile) for tile, _, _ in tiles]
+    results = model(batch)
+    timings["inference"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    offsets = [(left, top) for _, left, top in tiles]
+    obbs = postprocess_obb_batch(
+        results, offsets, allowed_class_ids(model.names, ALLOWED_CLASSES), CONF_THRESHOLD, reader.scale
+    )
+    obbs = merge_overlapping_obbs(obbs, NMS_IOU_THRESHOLD)
+    bboxes = obbs_to_bboxes(obbs, model.names)
+    timings["postprocess"] = time.perf_counter() - t0
+    del tiles, batch, results
+
+    t0 = time.perf_counter()
+    base, scale = reader.render_base()
+    annotated = draw_obb_bboxes(base, bboxes, scale)
+    timings["draw"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    annotated.save(io.BytesIO(), "JPEG")
+    timings["jpeg_encode"] = time.perf_counter() - t0
+
+    reader.close()
+    return timings, len(bboxes)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 回報，macOS 以 bytes 回報
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def benchmark(sizes, image_format, repeat, model):
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "format": image_format,
+            "repeat": repeat,
+            "tile_size": TILE_SIZE,
+            "tile_overlap": TILE_OVERLAP,
+            "boxes_per_tile": model.boxes_per_tile,
+        },
+        "results": {},
+    }
+    for size in sizes:
+        data = make_synthetic_image(size, image_format)
+        runs = []
+        detections = 0
+        try:
+            for _ in range(repeat):
+                timings, detections = run_once(data, model)
+                runs.append(timings)
+        except ImageTooLargeError as e:
+            # 只能整張解碼的格式超過 MAX_DECODE_PIXELS，/analyze 也會拒絕
+            print(f"{size}px: 略過（{e}）")
+            report["results"][str(size)] = {"encoded_bytes": len(data), "skipped": str(e)}
+            continue
+        stages = {}
+        for stage in STAGES:
+            values = [run[stage] * 1000 for run in runs]
+            stages[stage] = {
+                "min_ms": min(values),
+                "median_ms": statistics.median(values),
+                "mean_ms": statistics.fmean(values),
+            }
+        report["results"][str(size)] = {
+            "encoded_bytes": len(data),
+            "detections": detections,
+            "stages": stages,
+            "total_median_ms": sum(s["median_ms"] for s in stages.values()),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        print(f"{size}px: " + ", ".join(f"{k}={v['median_ms']:.1f}ms" for k, v in stages.items()))
+    return report
+
+
+def compare(report, baseline):
+    """列出各尺寸、各階段 median 相對基準報告的倍率（>1 代表變慢）。"""
+    for size, result in report["results"].items():
+        base = baseline.get("results", {}).get(size)
+        if not base or "stages" not in base or "stages" not in result:
+            continue
+        parts = []
+        for stage, value in result["stages"].items():
+            old = base["stages"].get(stage, {}).get("median_ms")
+            if old:
+                parts.append(f"{stage}×{value['median_ms'] / old:.2f}")
+        print(f"{size}px vs baseline: " + ", ".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/analyze 偵測流程分段基準測試")
+    parser.add_argument("--sizes", default="1024,4096,10000,20000", help="以逗號分隔的影像邊長（像素）")
+    parser.add_argument("--format", default="JPEG", choices=["JPEG", "PNG", "TIFF"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--boxes-per-tile", type=int, default=50)
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="stub 模型每個 tile 模擬的推理時間")
+    parser.add_argument("--output", default="bench_detect.json")
+    parser.add_argument("--compare", help="與先前的報告比較")
+    parser.add_argument("--check-tiling", action="store_true", help="只檢查 TIFF 視窗解碼結果是否正確")
+    args = parser.parse_args()
+
+    if args.check_tiling:
+        failures = check_tiling()
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1 if failures else 0)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    model = StubObbModel(args.boxes_per_tile, args.stub_latency_ms)
+    report = benchmark(sizes, args.format, args.repeat, model)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"報告已寫入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
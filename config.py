@@ -1,12 +1,48 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 
-def make_engine_and_session(db_path: str):
+# PRAGMA 只能以字串組成，限定可用的值
+JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SYNCHRONOUS_LEVELS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+def sqlite_pragmas(journal_mode=None, synchronous=None, mmap_size=None, cache_size=None, busy_timeout=None):
+    """
+    將調校選項轉為 PRAGMA 列表，None 表示維持 SQLite 預設：
+      journal_mode  例如 "WAL"：讀取不再擋住寫入
+      synchronous   例如 "NORMAL"：WAL 下仍可避免資料庫損毀，但 commit 不必每次 fsync
+      mmap_size     記憶體對映讀取的位元組數
+      cache_size    頁快取大小，負值代表 KiB
+      busy_timeout  資料庫被鎖住時等待的毫秒數，避免立即拋出 database is locked
+    """
+    pragmas = []
+    if journal_mode is not None:
+        journal_mode = journal_mode.upper()
+        if journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"不支援的 journal_mode：{journal_mode}")
+        pragmas.append(f"journal_mode={journal_mode}")
+    if synchronous is not None:
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"不支援的 synchronous：{synchronous}")
+        pragmas.append(f"synchronous={synchronous}")
+    if mmap_size is not None:
+        pragmas.append(f"mmap_size={int(mmap_size)}")
+    if cache_size is not None:
+        pragmas.append(f"cache_size={int(cache_size)}")
+    if busy_timeout is not None:
+        pragmas.append(f"busy_timeout={int(busy_timeout)}")
+    return pragmas
+
+
+def make_engine_and_session(db_path: str, journal_mode=None, synchronous=None, mmap_size=None,
+                            cache_size=None, busy_timeout=None):
     """
     建立一個獨立的 SQLAlchemy engine、session、Base
     用來管理多個 SQLite 資料庫（非 Flask 綁定的）
+    其餘參數為 SQLite 調校選項（見 sqlite_pragmas），每條新連線建立時套用
     """
 
     # 將路徑轉為絕對路徑，避免 Flask 與 Scheduler session 不一致
@@ -21,6 +57,15 @@ def make_engine_and_session(db_path: str):
         echo=False,
     )
 
+    pragmas = sqlite_pragmas(journal_mode, synchronous, mmap_size, cache_size, busy_timeout)
+    if pragmas:
+        @event.listens_for(engine, "connect")
+        def _apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(f"PRAGMA {pragma}")
+            cursor.close()
+
     # 建立 scoped session（確保 Thread-Safe）
     Session = scoped_session(sessionmaker(bind=engine))
 
@@ -0,0 +1,80 @@
+"""
+/analyze 偵測流程中不依賴 torch 的部分：偵測參數、切 tile、批次後處理、合併重疊框與繪圖。
+app.py 與 bench_detect.py 共用，基準測試不需載入模型或啟動服務。
+"""
+import os
+
+import numpy as np
+from PIL import ImageDraw, ImageFont
+
+from obb_utils import rotated_nms, obb_corners, allowed_class_ids, postprocess_obb_batch
+from tiling import iter_image_tiles
+
+# 偵測參數：tile 大小、重疊像素與每次送入模型的 tile 數
+TILE_SIZE = 1024
+TILE_OVERLAP = int(os.environ.get("TILE_OVERLAP", 128))
+NMS_IOU_THRESHOLD = float(os.environ.get("NMS_IOU_THRESHOLD", 0.5))
+CONF_THRESHOLD = float(os.environ.get("CONF_THRESHOLD", 0.25))
+TILE_BATCH_SIZE = int(os.environ.get("TILE_BATCH_SIZE", 8))
+ALLOWED_CLASSES = ["plane", "ship", "storage tank", "helicopter"]
+
+
+def split_image_into_tiles(image, tile_size, overlap):
+    return list(iter_image_tiles(image, tile_size, overlap))
+
+
+def run_yolo11n_obb_on_batch_tiles(model, tiles, allowed_classes=None, scale=1.0, conf_threshold=0.0):
+    """
+    對一批 tile 執行 OBB 偵測，回傳原始影像座標的 (M, 7) 陣列
+    [中心點_x, 中心點_y, 寬度, 高度, 角度, 信心度, 類別編號]。
+    類別過濾、信心度門檻與 tile 偏移皆以整批陣列運算完成，
+    scale 為解碼影像相對原始影像的倍率（JPEG draft mode 時大於 1）。
+    """
+    # 將 PIL 影像轉為 numpy 陣列，建立批次輸入
+    batch = [np.array(tile.convert('RGB')) for tile, _, _ in tiles]
+    results = model(batch)
+    offsets = [(left, top) for _, left, top in tiles]
+    class_ids = allowed_class_ids(model.names, allowed_classes)
+    return postprocess_obb_batch(results, offsets, class_ids, conf_threshold, scale)
+
+
+def merge_overlapping_obbs(obbs, iou_threshold):
+    """
+    重疊 tile 會對跨邊界的目標產生重複框，以全域座標的旋轉框 NMS（同類別）去除。
+    """
+    if len(obbs) < 2:
+        return obbs
+    keep = rotated_nms(obbs[:, :5], obbs[:, 5], iou_threshold, obbs[:, 6].astype(np.int64))
+    return obbs[np.sort(keep)]
+
+
+def draw_obb_bboxes(image, bboxes, scale=1.0):
+    """
+    將 bboxes 畫在 image 上；image 為原始影像縮小 scale 倍後的底圖。
+    """
+    if not bboxes:
+        return image
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    # 定義預設顏色清單（若類別數超過清單數量，會重複循環）
+    colors = ['yellow','red', 'blue', 'green', 'magenta', 'cyan', 'orange', 'purple']
+    # 建立類別對應顏色的字典
+    class_color_map = {}
+    # 一次算出所有旋轉框在底圖上的頂點
+    obbs = np.array([b["obb"][:5] for b in bboxes], dtype=np.float64)
+    obbs[:, :4] /= scale
+    corners = np.intp(obb_corners(obbs)).tolist()
+    for bbox, points in zip(bboxes, corners):
+        class_name = bbox["class_name"]
+        # 依照類別決定顏色，若尚未建立對應則從 colors 清單中依序指派
+        if class_name not in class_color_map:
+            class_color_map[class_name] = colors[len(class_color_map) % len(colors)]
+        color = class_color_map[class_name]
+
+        # 使用 draw.line 畫出較粗的偵測框（設定線寬為 3）
+        points = [tuple(p) for p in points]
+        draw.line(points + [points[0]], fill=color, width=3)
+
+        x_text, y_text = min(p[0] for p in points), min(p[1] for p in points)
+        draw.text((x_text, y_text - 10), class_name, font=font, fill=color)
+    return image
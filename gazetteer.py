@@ -0,0 +1,222 @@
+import bisect
+import csv
+import difflib
+import json
+import os
+import unicodedata
+from collections import defaultdict
+
+try:
+    from opencc import OpenCC
+except ImportError:  # 選用：未安裝時只用下方的簡繁對照表
+    OpenCC = None
+
+# 簡體 -> 正體字對照（OpenCC 未安裝時的退路），涵蓋台灣與周邊海域地名常用字；
+# 一字對多字（如 发 -> 發 / 髮、后 -> 后 / 後）的字不列入，避免把正體地名轉錯
+_SIMPLIFIED = {
+    "湾": "灣", "岛": "島", "屿": "嶼", "门": "門", "头": "頭", "东": "東", "马": "馬", "鸡": "雞",
+    "兰": "蘭", "龙": "龍", "泽": "澤", "广": "廣", "厦": "廈", "钓": "釣", "鱼": "魚", "县": "縣",
+    "区": "區", "乡": "鄉", "镇": "鎮", "丽": "麗", "宁": "寧", "阳": "陽", "凤": "鳳", "义": "義",
+    "树": "樹", "庙": "廟", "场": "場", "车": "車", "机": "機", "码": "碼", "观": "觀", "渔": "漁",
+    "滨": "濱", "浅": "淺", "滩": "灘", "沟": "溝", "岭": "嶺", "云": "雲", "华": "華", "苏": "蘇",
+    "罗": "羅", "关": "關", "园": "園", "圆": "圓", "长": "長", "万": "萬", "丰": "豐", "汤": "湯",
+    "达": "達", "灯": "燈", "卫": "衛", "营": "營", "军": "軍", "舰": "艦", "号": "號", "闽": "閩",
+    "粤": "粵", "赣": "贛", "绿": "綠", "兴": "興", "庆": "慶", "恒": "恆", "满": "滿", "厂": "廠",
+    "库": "庫", "医": "醫", "学": "學",
+    # 海峽、港灣與離島
+    "峡": "峽", "莲": "蓮", "连": "連", "乌": "烏", "垦": "墾", "鹅": "鵝", "銮": "鑾", "龟": "龜",
+    "贡": "貢", "鸟": "鳥", "猫": "貓", "狮": "獅", "鲸": "鯨", "鲤": "鯉", "鲁": "魯", "鹭": "鷺",
+    "鸭": "鴨", "虾": "蝦", "桥": "橋", "线": "線", "标": "標", "闸": "閘", "坝": "壩", "浊": "濁",
+    "汉": "漢", "岗": "崗", "壳": "殼", "仑": "崙", "冈": "岡", "坛": "壇", "宫": "宮", "阁": "閣",
+    "馆": "館", "寿": "壽", "宝": "寶", "凯": "凱", "宾": "賓", "缅": "緬", "韩": "韓", "亚": "亞",
+    "乐": "樂", "尔": "爾", "济": "濟", "钢": "鋼", "铁": "鐵", "经": "經", "纬": "緯", "黄": "黃",
+    "绳": "繩", "冲": "沖", "与": "與",
+    # 軍事、設施與行政用字
+    "国": "國", "际": "際", "战": "戰", "备": "備", "试": "試", "验": "驗", "电": "電", "储": "儲",
+    "气": "氣", "总": "總", "练": "練", "联": "聯", "队": "隊", "会": "會", "旧": "舊", "湿": "濕",
+    "净": "淨", "礼": "禮", "贵": "貴", "爱": "愛", "运": "運", "输": "輸", "补": "補", "给": "給",
+    "护": "護", "阵": "陣", "导": "導", "弹": "彈", "飞": "飛", "务": "務", "处": "處", "厅": "廳",
+    "邮": "郵", "农": "農", "渊": "淵", "盐": "鹽",
+}
+# 正體異體字統一（臺 -> 台），讓「台灣」「臺灣」落在同一個索引鍵
+_TRADITIONAL_VARIANTS = {"臺": "台"}
+_VARIANT_TABLE = str.maketrans({**_SIMPLIFIED, **_TRADITIONAL_VARIANTS})
+
+# 有安裝 OpenCC 時先以完整的簡轉繁詞庫轉換，再套用上方對照表統一異體字
+_S2T = OpenCC("s2t") if OpenCC is not None else None
+_T2S = OpenCC("t2s") if OpenCC is not None else None
+_SIMPLIFY_TABLE = str.maketrans({t: s for s, t in _SIMPLIFIED.items()})
+
+
+def normalize_name(name):
+    """索引鍵：NFKC（全形轉半形）、忽略大小寫與空白，並將簡體 / 異體字轉為同一寫法。"""
+    name = "".join(unicodedata.normalize("NFKC", str(name)).casefold().split())
+    if _S2T is not None:
+        name = _S2T.convert(name)
+    return name.translate(_VARIANT_TABLE)
+
+
+def to_simplified(name):
+    """正體地名的簡體寫法（有 OpenCC 時用 t2s，否則以對照表反查）。"""
+    if _T2S is not None:
+        return _T2S.convert(name)
+    return name.translate(_SIMPLIFY_TABLE)
+
+
+def _bigrams(key):
+    return {key[i:i + 2] for i in range(len(key) - 1)} or {key}
+
+
+class Gazetteer:
+    """
+    離線地名索引，支援三種比對（依序嘗試）：
+      exact   正規化後完全相同（含別名）
+      prefix  查詢字串是唯一一個地名的前綴，例如「三芝雷達」->「三芝雷達站」
+      fuzzy   以字元 bigram 找候選，再以相似度（difflib ratio）取最高且不低於門檻者
+    """
+
+    def __init__(self, fuzzy_threshold=0.85, max_fuzzy_candidates=20):
+        self.fuzzy_threshold = fuzzy_threshold
+        self.max_fuzzy_candidates = max_fuzzy_candidates
+        self._places = []      # index -> (名稱, {"latitude", "longitude"})
+        self._exact = {}       # 正規化鍵 -> index
+        self._sorted_keys = None  # 前綴比對用，新增地名後於下次查詢時重建
+        self._bigram_index = defaultdict(set)
+
+    def __len__(self):
+        return len(self._places)
+
+    def add(self, name, latitude, longitude, aliases=()):
+        index = len(self._places)
+        self._places.append((name, {"latitude": float(latitude), "longitude": float(longitude)}))
+        for alias in (name, *aliases):
+            key = normalize_name(alias)
+            if not key or key in self._exact:
+                continue
+            self._exact[key] = index
+            self._sorted_keys = None
+            for gram in _bigrams(key):
+                self._bigram_index[gram].add(key)
+
+    def load(self, path):
+        """依副檔名載入 CSV 或 GeoJSON，回傳新增的地名數。"""
+        before = len(self)
+        if path.lower().endswith((".geojson", ".json")):
+            self._load_geojson(path)
+        else:
+            self._load_csv(path)
+        return len(self) - before
+
+    def _load_csv(self, path):
+        # 欄位：name, latitude（或 lat）, longitude（或 lon / lng），選填 aliases（以 | 分隔）
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                lat = row.get("latitude") or row.get("lat")
+                lon = row.get("longitude") or row.get("lon") or row.get("lng")
+                if not row.get("name") or lat in (None, "") or lon in (None, ""):
+                    continue
+                aliases = [a.strip() for a in (row.get("aliases") or "").split("|") if a.strip()]
+                self.add(row["name"].strip(), lat, lon, aliases)
+
+    def _load_geojson(self, path):
+        # Point feature，properties.name 為地名，properties.aliases 為選填的別名列表
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for feature in data.get("features", []):
+            geometry = feature.get("geometry") or {}
+            properties = feature.get("properties") or {}
+            if geometry.get("type") != "Point" or not properties.get("name"):
+                continue
+            lon, lat = geometry["coordinates"][:2]
+            self.add(properties["name"], lat, lon, properties.get("aliases") or ())
+
+    def _prefix_match(self, key):
+        if self._sorted_keys is None:
+            self._sorted_keys = sorted(self._exact)
+        start = bisect.bisect_left(self._sorted_keys, key)
+        matches = set()
+        for candidate in self._sorted_keys[start:]:
+            if not candidate.startswith(key):
+                break
+            matches.add(self._exact[candidate])
+            if len(matches) > 1:
+                return None
+        return matches.pop() if matches else None
+
+    def _fuzzy_match(self, key):
+        counts = defaultdict(int)
+        for gram in _bigrams(key):
+            for candidate in self._bigram_index.get(gram, ()):
+                counts[candidate] += 1
+        if not counts:
+            return None
+        candidates = sorted(counts, key=counts.get, reverse=True)[:self.max_fuzzy_candidates]
+        best_score, best = 0.0, None
+        for candidate in candidates:
+            score = difflib.SequenceMatcher(None, key, candidate).ratio()
+            if score > best_score:
+                best_score, best = score, candidate
+        return self._exact[best] if best_score >= self.fuzzy_threshold else None
+
+    def match(self, place_name, approximate=True):
+        """
+        回傳 (地名, 座標, 比對方式)；找不到時回傳 None。
+        approximate=False 時只做 exact 比對：前綴與模糊比對可能對到不同地點
+        （例如「高雄」->「高雄港」），不適合在還能查 Places 時直接採用。
+        """
+        key = normalize_name(place_name)
+        if not key:
+            return None
+        index, how = self._exact.get(key), "exact"
+        if index is None and not approximate:
+            return None
+        if index is None and len(key) >= 2:
+            index, how = self._prefix_match(key), "prefix"
+        if index is None:
+            index, how = self._fuzzy_match(key), "fuzzy"
+        if index is None:
+            return None
+        name, coordinates = self._places[index]
+        return name, dict(coordinates), how
+
+    def lookup(self, place_name, approximate=True):
+        """回傳 {"latitude", "longitude"} 或 None。"""
+        matched = self.match(place_name, approximate)
+        return matched[1] if matched else None
+
+    def check_simplified_spellings(self):
+        """
+        每個地名改用簡體寫法後，exact 比對必須對到同一筆；
+        回傳對不到的 (地名, 簡體寫法) 列表，空列表代表全部通過。
+        未安裝 OpenCC 時簡體寫法由對照表反查，只能驗證對照表本身，需安裝 OpenCC 才能找出漏列的字。
+        """
+        misses = []
+        for name, _ in self._places:
+            simplified = to_simplified(name)
+            if simplified != name and self._exact.get(normalize_name(simplified)) != self._exact.get(normalize_name(name)):
+                misses.append((name, simplified))
+        return misses
+
+
+def load_gazetteer(path, fuzzy_threshold=0.85):
+    """path 不存在時回傳 None（未設定離線地名資料）。"""
+    if not path or not os.path.exists(path):
+        return None
+    gazetteer = Gazetteer(fuzzy_threshold=fuzzy_threshold)
+    gazetteer.load(path)
+    return gazetteer
+
+
+if __name__ == "__main__":
+    # python gazetteer.py [地名檔]：檢查每個地名的簡體寫法都能以 exact 比對查到
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "db", "gazetteer.csv")
+    gazetteer = load_gazetteer(path)
+    if gazetteer is None:
+        sys.exit(f"找不到地名檔：{path}")
+    misses = gazetteer.check_simplified_spellings()
+    for name, simplified in misses:
+        print(f"❌ {simplified} 查不到 {name}")
+    print(f"{len(gazetteer)} 筆地名，OpenCC {'已' if OpenCC is not None else '未'}安裝，{len(misses)} 筆簡體寫法查不到")
+    sys.exit(1 if misses else 0)
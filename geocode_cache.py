@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import Column, Float, String
+
+from config import make_engine_and_session
+
+
+def normalize_place_name(place_name):
+    """快取鍵：去除前後空白、合併連續空白並忽略英文大小寫。"""
+    return " ".join(str(place_name).split()).casefold()
+
+
+class GeocodeCache:
+    """
+    地名座標的兩層快取：行程內 LRU 在前，SQLite 持久層在後。
+
+    值為 {"latitude": .., "longitude": ..}；查無結果以 None 表示，
+    以較短的 negative_ttl 快取，避免同一個錯字反覆打到 Google Places。
+    get() 回傳 (是否命中, 值)，讓呼叫端能區分「快取的 None」與「未命中」。
+    """
+
+    def __init__(self, db_path, ttl=30 * 86400, negative_ttl=3600, max_memory_entries=1024):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_memory_entries = max_memory_entries
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (value, expires_at)，由舊到新
+        # SQLite 同時只允許一個寫入者；在行程內先排隊，避免多執行緒寫入時進入 busy 等待
+        self._write_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.engine, self.Session, Base = make_engine_and_session(db_path)
+
+        class GeocodeEntry(Base):
+            __tablename__ = "geocode_cache"
+            key = Column(String(256), primary_key=True)
+            latitude = Column(Float, nullable=True)
+            longitude = Column(Float, nullable=True)
+            expires_at = Column(Float, nullable=False)
+
+        self.Entry = GeocodeEntry
+        Base.metadata.create_all(self.engine)
+        self.purge_expired()
+
+    def get(self, place_name):
+        key = normalize_place_name(place_name)
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                if item[1] > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return True, _copy(item[0])
+                del self._memory[key]
+
+        session = self.Session()
+        try:
+            row = session.get(self.Entry, key)
+            if row is None or row.expires_at <= now:
+                with self._lock:
+                    self.misses += 1
+                return False, None
+            value = None if row.latitude is None else {"latitude": row.latitude, "longitude": row.longitude}
+            expires_at = row.expires_at
+        finally:
+            session.close()
+
+        with self._lock:
+            self.hits += 1
+            self._remember(key, value, expires_at)
+        return True, _copy(value)
+
+    def put(self, place_name, value):
+        key = normalize_place_name(place_name)
+        expires_at = time.time() + (self.ttl if value is not None else self.negative_ttl)
+        with self._lock:
+            self._remember(key, _copy(value), expires_at)
+
+        session = self.Session()
+        try:
+            with self._write_lock:
+                session.merge(self.Entry(
+                    key=key,
+                    latitude=value["latitude"] if value is not None else None,
+                    longitude=value["longitude"] if value is not None else None,
+                    expires_at=expires_at,
+                ))
+                session.commit()
+        finally:
+            session.close()
+
+    def purge_expired(self):
+        """刪除 SQLite 中已過期的項目，回傳刪除筆數。"""
+        session = self.Session()
+        try:
+            deleted = session.query(self.Entry).filter(self.Entry.expires_at <= time.time()).delete()
+            session.commit()
+            return deleted
+        finally:
+            session.close()
+
+    def _remember(self, key, value, expires_at):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+
+def _copy(value):
+    # 回傳副本，避免呼叫端修改到快取內的 dict
+    return dict(value) if value is not None else None
@@ -0,0 +1,64 @@
+import numpy as np
+
+# WGS84 平均地球半徑（公里）
+EARTH_RADIUS_KM = 6371.0088
+
+
+def points_for_radius(radius_km, tolerance_m=10.0, min_points=16, max_points=256):
+    """
+    依半徑與容許誤差決定圓周點數：以 n 邊形近似圓時，邊中點離真實圓周最遠
+    r * (1 - cos(pi / n))，取讓此距離不超過 tolerance_m 的最小 n。
+    """
+    radius_m = np.asarray(radius_km, dtype=np.float64) * 1000.0
+    ratio = np.clip(1.0 - tolerance_m / np.maximum(radius_m, 1e-9), -1.0, 1.0)
+    with np.errstate(divide="ignore"):
+        n = np.ceil(np.pi / np.arccos(ratio))
+    return np.clip(np.nan_to_num(n, posinf=max_points), min_points, max_points).astype(np.int64)
+
+
+def destination_points(lon, lat, bearing, distance_km):
+    """
+    球面上的 destination point：從 (lon, lat) 沿方位角 bearing（弧度，正北為 0、順時針）
+    前進 distance_km 後的位置，所有參數皆可廣播，回傳 (lon, lat) 度數陣列。
+    地球以半徑 EARTH_RADIUS_KM 的球體近似，誤差約 0.3%，遠小於舊版平面近似。
+    """
+    lat1 = np.radians(lat)
+    lon1 = np.radians(lon)
+    delta = np.asarray(distance_km, dtype=np.float64) / EARTH_RADIUS_KM
+    sin_lat1, cos_lat1 = np.sin(lat1), np.cos(lat1)
+    sin_delta, cos_delta = np.sin(delta), np.cos(delta)
+    sin_lat2 = np.clip(sin_lat1 * cos_delta + cos_lat1 * sin_delta * np.cos(bearing), -1.0, 1.0)
+    lat2 = np.arcsin(sin_lat2)
+    delta_lon = np.arctan2(np.sin(bearing) * sin_delta * cos_lat1, cos_delta - sin_lat1 * sin_lat2)
+    # 經度以起點為基準展開而不折回 [-180, 180)，跨越 180 度經線的圓才會是連續的環
+    return np.degrees(lon1 + delta_lon), np.degrees(lat2)
+
+
+def buffer_rings(lons, lats, radii_km, num_points=None, tolerance_m=10.0, min_points=16, max_points=256):
+    """
+    一次產生多個圓形 buffer 的外環，回傳 GeoJSON Polygon 外環列表（每個為首尾相同的 [lon, lat] 列表）。
+
+    num_points 為 None 時依半徑與 tolerance_m 自動決定點數；
+    點數相同的圓合併成一個 (圓數, 點數) 陣列一起計算。
+    """
+    lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+    lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+    radii = np.broadcast_to(np.asarray(radii_km, dtype=np.float64), lons.shape)
+    if num_points is None:
+        counts = points_for_radius(radii, tolerance_m, min_points, max_points)
+    else:
+        counts = np.full(lons.shape, int(num_points), dtype=np.int64)
+
+    rings = [None] * len(lons)
+    for n in np.unique(counts):
+        idx = np.flatnonzero(counts == n)
+        # 方位角從正東逆時針排列，與舊版 建立_buffer_polygon 的點序相同
+        bearings = np.pi / 2 - 2 * np.pi * np.arange(n) / n
+        ring_lon, ring_lat = destination_points(
+            lons[idx, None], lats[idx, None], bearings[None, :], radii[idx, None]
+        )
+        coords = np.stack([ring_lon, ring_lat], axis=-1)
+        coords = np.concatenate([coords, coords[:, :1]], axis=1)
+        for i, ring in zip(idx, coords.tolist()):
+            rings[i] = ring
+    return rings
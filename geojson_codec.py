@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # 選用：未安裝時退回標準 json
+    orjson = None
+
+# 小數 6 位約 0.1 公尺，對地圖顯示已足夠
+DEFAULT_PRECISION = 6
+MAX_PRECISION = 15
+
+
+def _round_coordinates(coords, precision):
+    if not coords:
+        return coords
+    first = coords[0]
+    if isinstance(first, (int, float)):
+        return [round(c, precision) for c in coords]
+    if isinstance(first, list) and first and isinstance(first[0], (int, float)):
+        # 一整個 ring / LineString 以陣列運算一次處理
+        try:
+            return np.round(np.asarray(coords, dtype=np.float64), precision).tolist()
+        except ValueError:
+            pass
+    return [_round_coordinates(c, precision) for c in coords]
+
+
+def round_geojson(obj, precision=DEFAULT_PRECISION):
+    """回傳座標取到 precision 位小數的 GeoJSON 副本（不修改原物件），properties 保持不變。"""
+    if isinstance(obj, list):
+        return [round_geojson(item, precision) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    out = dict(obj)
+    if "coordinates" in out:
+        out["coordinates"] = _round_coordinates(out["coordinates"], precision)
+    for key in ("features", "geometries"):
+        if key in out:
+            out[key] = [round_geojson(item, precision) for item in out[key]]
+    if isinstance(out.get("geometry"), dict):
+        out["geometry"] = round_geojson(out["geometry"], precision)
+    return out
+
+
+def parse_precision(value, default=DEFAULT_PRECISION):
+    """解析請求中的 precision，無效值回傳預設，並限制在 0..MAX_PRECISION。"""
+    try:
+        precision = int(value)
+    except (TypeError, ValueError):
+        return default
+    return min(max(precision, 0), MAX_PRECISION)
+
+
+def dumps_compact(obj):
+    """無縮排、不跳脫中文的 JSON 字串；有 orjson 時使用 orjson。"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,199 @@
+import asyncio
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 視為暫時性失敗、值得重試的 HTTP 狀態碼
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+def backoff_delay(backoff, max_backoff, attempt):
+    """full jitter：在 [0, backoff * 2^attempt] 之間隨機取等待秒數。"""
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+class CircuitOpenError(RuntimeError):
+    """斷路器開啟中，直接拒絕呼叫外部服務。"""
+
+
+class CircuitBreaker:
+    """
+    連續失敗 failure_threshold 次後開啟，reset_timeout 秒內的呼叫直接失敗；
+    時間到後進入半開狀態只放行一個試探呼叫，成功即關閉，失敗則重新開啟。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                raise CircuitOpenError("外部服務暫時停用（斷路器開啟中）")
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """呼叫被中斷（例如取消）而沒有結果時，不計成功或失敗，只讓下一個呼叫可以再試探。"""
+        with self._lock:
+            self._probing = False
+
+
+class HttpClient:
+    """
+    對外 HTTP 呼叫的共用客戶端：
+    - requests.Session + 連線池，重複使用 keep-alive 連線
+    - 每次呼叫都有 (connect, read) timeout
+    - 連線錯誤、逾時與 RETRY_STATUS 以指數退避加隨機抖動重試
+    - 每個客戶端一個斷路器，服務持續失敗時快速失敗而不佔住 worker
+    base_url 可指向本機的 stub 伺服器做測試。
+    """
+
+    def __init__(self, base_url, timeout=(3.05, 10.0), max_retries=2, backoff=0.25,
+                 max_backoff=4.0, pool_size=16, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _sleep_before_retry(self, attempt):
+        time.sleep(backoff_delay(self.backoff, self.max_backoff, attempt))
+
+    def request(self, method, path, **kwargs):
+        """
+        送出請求並回傳 requests.Response；重試用盡後拋出最後一次的錯誤，
+        斷路器開啟時拋出 CircuitOpenError。
+        """
+        self.breaker.before_call()
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            response = self._send_with_retries(method, url, **kwargs)
+        except Exception:
+            # 不重試的錯誤（ChunkedEncodingError、TooManyRedirects 等）也要記錄，
+            # 否則半開狀態的試探呼叫失敗後斷路器會一直停在試探中
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release_probe()
+            raise
+        self.breaker.record_success()
+        return response
+
+    def _send_with_retries(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code in RETRY_STATUS:
+                    response.raise_for_status()
+                return response
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError):
+                if attempt >= self.max_retries:
+                    raise
+                self._sleep_before_retry(attempt)
+                attempt += 1
+
+    def get_json(self, path, params=None, **kwargs):
+        response = self.request("GET", path, params=params, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncHttpClient:
+    """
+    HttpClient 的 asyncio 版本（httpx.AsyncClient），timeout、重試與斷路器行為相同；
+    可傳入同步客戶端的 breaker，讓兩條路徑共用同一個斷路器狀態。
+    """
+
+    def __init__(self, base_url, timeout=(3.05, 10.0), max_retries=2, backoff=0.25,
+                 max_backoff=4.0, pool_size=100, breaker=None):
+        import httpx
+
+        self._httpx = httpx
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        connect_timeout, read_timeout = timeout
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def request(self, method, path, **kwargs):
+        self.breaker.before_call()
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        try:
+            response = await self._send_with_retries(method, url, **kwargs)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # asyncio 取消：沒有結果，只釋放試探名額
+            self.breaker.release_probe()
+            raise
+        self.breaker.record_success()
+        return response
+
+    async def _send_with_retries(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                if response.status_code in RETRY_STATUS:
+                    response.raise_for_status()
+                return response
+            except (self._httpx.TransportError, self._httpx.HTTPStatusError):
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(backoff_delay(self.backoff, self.max_backoff, attempt))
+                attempt += 1
+
+    async def get_json(self, path, params=None, **kwargs):
+        response = await self.request("GET", path, params=params, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,181 @@
+import ast
+import hashlib
+import os
+import shutil
+
+import numpy as np
+
+from obb_utils import rotated_nms
+
+# 與 ultralytics predict 預設一致的後處理參數
+DEFAULT_CONF = 0.25
+DEFAULT_IOU = 0.7
+DEFAULT_IMGSZ = 1024
+DEFAULT_MAX_DET = 300
+
+# 匯出的 ONNX 檔快取目錄
+ONNX_CACHE_DIR = os.environ.get("ONNX_CACHE_DIR", os.path.join(os.getcwd(), "onnx_cache"))
+
+
+def _empty_obb():
+    return np.zeros((0, 7), dtype=np.float32)
+
+
+def regularize_obb(obb):
+    """
+    與 ultralytics regularize_rboxes 相同：確保 w >= h，角度落在 [0, pi)。
+    obb 為 (N, 7) 的 [cx, cy, w, h, angle, conf, cls]。
+    """
+    obb = obb.copy()
+    w, h = obb[:, 2].copy(), obb[:, 3].copy()
+    swap = w < h
+    obb[:, 2] = np.maximum(w, h)
+    obb[:, 3] = np.minimum(w, h)
+    obb[:, 4] = np.where(swap, obb[:, 4] + np.pi / 2, obb[:, 4]) % np.pi
+    return obb
+
+
+class TorchBackend:
+    """ultralytics / torch 推理，輸出每個 tile 的 OBB 陣列 [cx, cy, w, h, angle, conf, cls]。"""
+
+    name = "torch"
+
+    def __init__(self, weights, device=None):
+        from ultralytics import YOLO
+
+        self.model = YOLO(weights)
+        if device:
+            self.model.to(device)
+        self.names = self.model.names
+
+    def warmup(self, imgsz=DEFAULT_IMGSZ):
+        self.model(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), verbose=False)
+
+    def __call__(self, batch):
+        results = self.model(batch, verbose=False)
+        return [
+            r.obb.data.cpu().numpy() if r.obb is not None else _empty_obb()
+            for r in results
+        ]
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def export_onnx(weights, imgsz=DEFAULT_IMGSZ, cache_dir=ONNX_CACHE_DIR):
+    """
+    將 YOLO 權重匯出為 ONNX（動態 batch），以權重內容雜湊 + imgsz 命名並快取，
+    權重未變動時直接回傳既有檔案。
+    """
+    from ultralytics import YOLO
+
+    os.makedirs(cache_dir, exist_ok=True)
+    model = YOLO(weights)
+    # 權重可能是第一次使用時才由 ultralytics 下載，以實際檔案路徑計算雜湊
+    weights_path = getattr(model, "ckpt_path", None) or weights
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    cached = os.path.join(cache_dir, f"{stem}-{imgsz}-{_file_digest(weights_path)}.onnx")
+    if not os.path.exists(cached):
+        exported = model.export(format="onnx", imgsz=imgsz, dynamic=True)
+        tmp_path = f"{cached}.tmp"
+        shutil.copyfile(exported, tmp_path)
+        os.replace(tmp_path, cached)
+    return cached
+
+
+class OnnxBackend:
+    """
+    onnxruntime CPU 推理，前後處理對齊 ultralytics：
+    tile 縮放後貼在 imgsz×imgsz 畫布左上角，輸出經信心度過濾、旋轉框 NMS 與角度正規化。
+
+    weights 可以是 YOLO 權重或已匯出的 .onnx 檔；前者在此匯出（需要載入 torch 模型），
+    多行程部署時應由主行程先呼叫 export_onnx 再傳入 .onnx 路徑。
+    """
+
+    name = "onnx"
+
+    def __init__(self, weights, imgsz=DEFAULT_IMGSZ, conf=DEFAULT_CONF, iou=DEFAULT_IOU,
+                 max_det=DEFAULT_MAX_DET, providers=("CPUExecutionProvider",), intra_op_threads=0):
+        import onnxruntime as ort
+
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+        if str(weights).lower().endswith(".onnx"):
+            self.onnx_path = weights
+        else:
+            self.onnx_path = export_onnx(weights, imgsz)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(self.onnx_path, sess_options=options, providers=list(providers))
+        self.input_name = self.session.get_inputs()[0].name
+        # ultralytics 匯出時會將類別名稱與任務類型寫入 metadata
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(meta["names"]) if "names" in meta else None
+        self.task = meta.get("task", "obb")
+
+    def warmup(self, imgsz=None):
+        self([np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)])
+
+    def _preprocess(self, batch):
+        import cv2
+
+        inputs = np.full((len(batch), self.imgsz, self.imgsz, 3), 114, dtype=np.uint8)
+        ratios = []
+        for i, tile in enumerate(batch):
+            h, w = tile.shape[:2]
+            ratio = min(self.imgsz / h, self.imgsz / w)
+            if ratio != 1.0:
+                tile = cv2.resize(tile, (max(1, round(w * ratio)), max(1, round(h * ratio))), interpolation=cv2.INTER_LINEAR)
+            inputs[i, :tile.shape[0], :tile.shape[1]] = tile
+            ratios.append(ratio)
+        # NHWC uint8 -> NCHW float32，與 ultralytics 相同以 RGB / 255 作為輸入
+        return np.ascontiguousarray(inputs.transpose(0, 3, 1, 2), dtype=np.float32) / 255.0, ratios
+
+    def _postprocess(self, pred, ratio):
+        # OBB head 輸出 (4 + nc + 1, N)：[cx, cy, w, h, 各類別分數..., angle]
+        pred = pred.T
+        scores = pred[:, 4:-1]
+        class_ids = scores.argmax(axis=1)
+        conf = scores[np.arange(len(scores)), class_ids]
+        keep = conf > self.conf
+        if not keep.any():
+            return _empty_obb()
+        boxes = np.concatenate([pred[keep, :4], pred[keep, -1:]], axis=1)
+        conf = conf[keep]
+        class_ids = class_ids[keep]
+        kept = rotated_nms(boxes, conf, self.iou, class_ids)[:self.max_det]
+        obb = np.concatenate(
+            [boxes[kept], conf[kept, None], class_ids[kept, None].astype(np.float32)], axis=1
+        ).astype(np.float32)
+        obb[:, :4] /= ratio
+        return regularize_obb(obb)
+
+    def __call__(self, batch):
+        if not batch:
+            return []
+        if self.task != "obb":
+            # 與 torch 後端一致：非 OBB 模型沒有旋轉框輸出
+            return [_empty_obb() for _ in batch]
+        inputs, ratios = self._preprocess(batch)
+        preds = self.session.run(None, {self.input_name: inputs})[0]
+        return [self._postprocess(pred, ratio) for pred, ratio in zip(preds, ratios)]
+
+
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def create_backend(backend, weights, **kwargs):
+    """依名稱建立推理後端（'torch' 或 'onnx'）。"""
+    if backend not in BACKENDS:
+        raise ValueError(f"不支援的推理後端: {backend}")
+    return BACKENDS[backend](weights, **kwargs)
@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class _Job:
+    """一次 submit() 的所有 tile，完成後將結果依原順序寫回 future。"""
+
+    def __init__(self, size):
+        self.future = Future()
+        self.results = [None] * size
+        self.remaining = size
+        self.lock = threading.Lock()
+
+    def set_result(self, index, result):
+        with self.lock:
+            self.results[index] = result
+            self.remaining -= 1
+            done = self.remaining == 0
+        if done and not self.future.done():
+            self.future.set_result(self.results)
+
+    def set_exception(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+class InferenceScheduler:
+    """
+    動態 micro-batching 推理排程器。
+
+    各請求以 submit() 提交 tile 批次，背景執行緒從共用佇列中收集 tile，
+    湊滿 max_batch_size 或等待超過 max_wait_ms 即執行一次 model(batch)，
+    再將每個 tile 的結果送回各自的呼叫者。
+    呼叫方式與 model 相同：scheduler(batch) 會阻塞直到該批結果完成。
+    """
+
+    def __init__(self, model, max_batch_size=16, max_wait_ms=10):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size 必須大於 0")
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def submit(self, batch):
+        """提交一批輸入，回傳 Future，其結果為與 batch 等長的結果列表。"""
+        if self._closed:
+            raise RuntimeError("InferenceScheduler 已關閉")
+        job = _Job(len(batch))
+        if not batch:
+            job.future.set_result([])
+            return job.future
+        for index, item in enumerate(batch):
+            self._queue.put((job, index, item))
+        return job.future
+
+    def __call__(self, batch):
+        return self.submit(batch).result()
+
+    def close(self):
+        """停止背景執行緒；已在佇列中的 tile 會先處理完。"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        """阻塞取得第一個 tile，之後在 max_wait 內盡量湊滿一個批次。"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        pending = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(pending) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                # 收到關閉訊號：先處理目前批次，再讓下一輪結束
+                self._queue.put(None)
+                break
+            pending.append(entry)
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            if pending is None:
+                return
+            try:
+                results = self.model([item for _, _, item in pending])
+            except Exception as ex:
+                for job, _, _ in pending:
+                    job.set_exception(ex)
+                continue
+            for (job, index, _), result in zip(pending, results):
+                job.set_result(index, result)
@@ -0,0 +1,190 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def _attach_shared_memory(name):
+    """
+    在 worker 端掛上父行程建立的共享記憶體，unlink 一律由父行程負責。
+    spawn 出來的 worker 與父行程共用同一個 resource_tracker，重複註冊不會造成重複清除。
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 以前沒有 track 參數
+        return shared_memory.SharedMemory(name=name)
+
+
+def _worker_main(backend, weights, torch_threads, task_queue, result_queue):
+    """
+    推理 worker 行程：各自持有一份模型並固定 torch 執行緒數，
+    從 task_queue 取得共享記憶體中的 tile，回傳每個 tile 的 OBB 陣列。
+    """
+    import torch
+    from inference_backends import create_backend
+
+    torch.set_num_threads(torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    try:
+        kwargs = {"intra_op_threads": torch_threads} if backend == "onnx" else {}
+        model = create_backend(backend, weights, **kwargs)
+        model.warmup()
+    except Exception as ex:
+        result_queue.put(("failed", None, repr(ex)))
+        return
+    result_queue.put(("ready", None, model.names))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        task_id, shm_name, layout = task
+        try:
+            shm = _attach_shared_memory(shm_name)
+            try:
+                batch = [
+                    np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+                    for offset, shape in layout
+                ]
+                outputs = model(batch)
+                # 釋放所有指向共享記憶體的 view 後才能 close
+                del batch
+            finally:
+                shm.close()
+            result_queue.put(("done", task_id, outputs))
+        except Exception as ex:
+            result_queue.put(("error", task_id, repr(ex)))
+
+
+class InferenceWorkerPool:
+    """
+    多行程 CPU 推理池。
+
+    每個 worker 行程各自載入一份模型；呼叫 pool(batch) 時將批次平均切給各 worker，
+    tile 透過 multiprocessing.shared_memory 傳遞而非 pickle NumPy 陣列，
+    回傳每個 tile 的 OBB 陣列 [cx, cy, w, h, angle, conf, cls]。
+    """
+
+    def __init__(self, backend, weights, num_workers, torch_threads=None, start_timeout=300):
+        if num_workers < 1:
+            raise ValueError("num_workers 必須大於 0")
+        if torch_threads is None:
+            torch_threads = max(1, (os.cpu_count() or 1) // num_workers)
+        ctx = mp.get_context("spawn")
+        self.num_workers = num_workers
+        self._task_queue = ctx.Queue()
+        self._result_queue = ctx.Queue()
+        self._pending = {}  # task_id -> (Future, SharedMemory)
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._closed = False
+        # worker 行程意外結束後整個池不再可用，由呼叫端（ModelRegistry）丟棄並重新載入
+        self.failed = False
+        self._processes = [
+            ctx.Process(
+                target=_worker_main,
+                args=(backend, weights, torch_threads, self._task_queue, self._result_queue),
+                name=f"inference-worker-{i}",
+                daemon=True,
+            )
+            for i in range(num_workers)
+        ]
+        for process in self._processes:
+            process.start()
+
+        # 等待所有 worker 載入模型完成
+        self.names = None
+        for _ in range(num_workers):
+            kind, _, payload = self._result_queue.get(timeout=start_timeout)
+            if kind == "failed":
+                self.close()
+                raise RuntimeError(f"推理 worker 啟動失敗: {payload}")
+            self.names = payload
+
+        self._collector = threading.Thread(target=self._collect, name="inference-pool-collector", daemon=True)
+        self._collector.start()
+
+    def submit(self, batch):
+        """提交一批 HxWx3 uint8 陣列，回傳 Future 列表（每個 worker 分到的一段各一個）。"""
+        if self._closed:
+            raise RuntimeError("InferenceWorkerPool 已關閉")
+        chunk_size = -(-len(batch) // self.num_workers)
+        futures = []
+        for start in range(0, len(batch), chunk_size):
+            futures.append(self._submit_chunk(batch[start:start + chunk_size]))
+        return futures
+
+    def _submit_chunk(self, arrays):
+        arrays = [np.ascontiguousarray(a, dtype=np.uint8) for a in arrays]
+        layout = []
+        offset = 0
+        for a in arrays:
+            layout.append((offset, a.shape))
+            offset += a.nbytes
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for (start, shape), a in zip(layout, arrays):
+            np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=start)[...] = a
+
+        future = Future()
+        task_id = next(self._task_ids)
+        with self._lock:
+            self._pending[task_id] = (future, shm)
+        self._task_queue.put((task_id, shm.name, layout))
+        return future
+
+    def __call__(self, batch):
+        outputs = []
+        for future in self.submit(batch):
+            outputs.extend(future.result())
+        return outputs
+
+    def _finish(self, task_id):
+        with self._lock:
+            future, shm = self._pending.pop(task_id)
+        shm.close()
+        shm.unlink()
+        return future
+
+    def _collect(self):
+        while True:
+            try:
+                kind, task_id, payload = self._result_queue.get(timeout=1.0)
+            except queue.Empty:
+                if self._closed and not self._pending:
+                    return
+                if not all(p.is_alive() for p in self._processes):
+                    self._fail_pending(RuntimeError("推理 worker 行程意外結束"))
+                    return
+                continue
+            if kind == "done":
+                self._finish(task_id).set_result(payload)
+            elif kind == "error":
+                self._finish(task_id).set_exception(RuntimeError(f"推理 worker 發生錯誤: {payload}"))
+
+    def _fail_pending(self, exc):
+        self._closed = True
+        self.failed = True
+        with self._lock:
+            task_ids = list(self._pending)
+        for task_id in task_ids:
+            self._finish(task_id).set_exception(exc)
+
+    def close(self):
+        """通知所有 worker 結束並等待行程退出。"""
+        self._closed = True
+        for _ in self._processes:
+            self._task_queue.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
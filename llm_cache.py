@@ -0,0 +1,79 @@
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_prompt(prompt):
+    """快取用的提示正規化：NFKC（全形轉半形）、合併連續空白、忽略英文大小寫。"""
+    return " ".join(unicodedata.normalize("NFKC", prompt).split()).casefold()
+
+
+def schema_version(*parts):
+    """以系統提示、工具定義等內容計算版本字串，任一項變動時舊快取自然失效。"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def make_cache_key(*parts):
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """
+    行程內的 LRU + TTL 快取，可多執行緒共用，並記錄命中率供監控。
+    超過 max_entries 時淘汰最久未使用的項目；過期項目於讀取時移除。
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key -> (value, expires_at)，由舊到新
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """回傳 (是否命中, 值)。"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if item[1] > time.monotonic():
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return True, item[0]
+                del self._items[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class _Entry:
+    def __init__(self):
+        self.value = None
+        self.ready = threading.Event()
+        self.error = None
+        self.in_use = 0
+        self.evicted = False
+
+
+class ModelRegistry:
+    """
+    模型登錄表：第一次使用時才呼叫 loader(name) 載入（含 warm-up），
+    最多同時常駐 max_resident 個模型，超過時依 LRU 淘汰最久未使用者。
+
+    被淘汰的模型若仍有請求在使用，會等最後一個使用者釋放後才呼叫 on_evict。
+    is_usable(value) 回傳 False 的常駐模型（例如 worker 行程已結束的推理池）
+    會在下次使用時移出登錄表並重新載入。
+    """
+
+    def __init__(self, loader, max_resident=2, on_evict=None, is_usable=None):
+        if max_resident < 1:
+            raise ValueError("max_resident 必須大於 0")
+        self._loader = loader
+        self._on_evict = on_evict
+        self._is_usable = is_usable
+        self.max_resident = max_resident
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # name -> _Entry，由舊到新
+
+    def resident(self):
+        """目前常駐（含載入中）的模型名稱，由最久未使用到最近使用。"""
+        with self._lock:
+            return list(self._entries)
+
+    @contextmanager
+    def use(self, name):
+        """
+        取得模型供本次請求使用：
+            with registry.use("yolo11n-obb") as model:
+                model(batch)
+        """
+        entry = self._acquire(name)
+        try:
+            yield entry.value
+        finally:
+            self._release(entry)
+
+    def _acquire(self, name):
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and self._is_stale(entry):
+                del self._entries[name]
+                entry.evicted = True
+                if entry.in_use == 0:
+                    evicted.append(entry)
+                entry = None
+            is_loader = entry is None
+            if is_loader:
+                entry = _Entry()
+                self._entries[name] = entry
+                while len(self._entries) > self.max_resident:
+                    old_name, old_entry = next(iter(self._entries.items()))
+                    if old_entry is entry:
+                        break
+                    del self._entries[old_name]
+                    old_entry.evicted = True
+                    if old_entry.in_use == 0 and old_entry.ready.is_set():
+                        evicted.append(old_entry)
+            self._entries.move_to_end(name)
+            entry.in_use += 1
+
+        for old_entry in evicted:
+            self._close(old_entry)
+
+        if is_loader:
+            try:
+                entry.value = self._loader(name)
+            except Exception as ex:
+                entry.error = ex
+                with self._lock:
+                    if self._entries.get(name) is entry:
+                        del self._entries[name]
+                    entry.in_use -= 1
+                raise
+            finally:
+                entry.ready.set()
+        else:
+            entry.ready.wait()
+            if entry.error is not None:
+                with self._lock:
+                    entry.in_use -= 1
+                raise entry.error
+        return entry
+
+    def _is_stale(self, entry):
+        if self._is_usable is None or not entry.ready.is_set() or entry.value is None:
+            return False
+        return not self._is_usable(entry.value)
+
+    def _release(self, entry):
+        with self._lock:
+            entry.in_use -= 1
+            should_close = entry.evicted and entry.in_use == 0
+        if should_close:
+            self._close(entry)
+
+    def _close(self, entry):
+        if self._on_evict is not None and entry.value is not None:
+            self._on_evict(entry.value)
@@ -0,0 +1,252 @@
+import numpy as np
+
+# 旋轉框 IoU 一次最多計算的候選配對數，用來限制暫存陣列的記憶體
+_IOU_CHUNK_PAIRS = 200_000
+_EPS = 1e-9
+
+
+def obb_corners(obbs):
+    """
+    將 (N, 5) 的 [cx, cy, w, h, angle(弧度)] 轉為 (N, 4, 2) 的四個頂點。
+    """
+    obbs = np.asarray(obbs, dtype=np.float64).reshape(-1, 5)
+    cx, cy, w, h, angle = obbs.T
+    cos_a = np.cos(angle)
+    sin_a = np.sin(angle)
+    # 以中心為原點的四個角點，順序為逆時針（影像座標系）
+    local_x = np.array([-0.5, 0.5, 0.5, -0.5])[None, :] * w[:, None]
+    local_y = np.array([-0.5, -0.5, 0.5, 0.5])[None, :] * h[:, None]
+    xs = cx[:, None] + local_x * cos_a[:, None] - local_y * sin_a[:, None]
+    ys = cy[:, None] + local_x * sin_a[:, None] + local_y * cos_a[:, None]
+    return np.stack([xs, ys], axis=-1)
+
+
+def _cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def _polygon_area(corners):
+    x = corners[..., 0]
+    y = corners[..., 1]
+    return 0.5 * np.sum(x * np.roll(y, -1, axis=-1) - np.roll(x, -1, axis=-1) * y, axis=-1)
+
+
+def _clipped_edge_integral(poly, clip, shared_edges):
+    """
+    以 Cyrus-Beck 將 poly 的每條邊裁切到凸多邊形 clip 內，
+    回傳裁切後線段的 cross(起點, 終點) 總和（Green 定理的邊界積分）。
+    與 clip 共線且同向的邊只能算一次，shared_edges=False 時排除。
+    """
+    px, py = poly[..., 0], poly[..., 1]  # (P, 4)
+    cx, cy = clip[..., 0], clip[..., 1]
+    dx = np.roll(px, -1, axis=1) - px  # poly 的邊向量
+    dy = np.roll(py, -1, axis=1) - py
+    ex = (np.roll(cx, -1, axis=1) - cx)[:, None, :]  # clip 的邊向量，(P, 1, 4)
+    ey = (np.roll(cy, -1, axis=1) - cy)[:, None, :]
+    # num >= 0 代表 poly 邊的起點在 clip 第 k 條邊的內側；den 為沿邊前進時的變化率
+    num = ex * (py[:, :, None] - cy[:, None, :]) - ey * (px[:, :, None] - cx[:, None, :])  # (P, 4, 4)
+    den = ex * dy[:, :, None] - ey * dx[:, :, None]
+    e_len2 = ex * ex + ey * ey
+    d_len2 = (dx * dx + dy * dy)[:, :, None]
+    parallel = den * den <= _EPS * _EPS * e_len2 * d_len2
+    on_line = num * num <= _EPS * _EPS * e_len2 * np.maximum(d_len2, 1.0)
+    if shared_edges:
+        outside = parallel & (num < 0) & ~on_line
+    else:
+        same_dir = (ex * dx[:, :, None] + ey * dy[:, :, None]) > 0
+        outside = parallel & (((num < 0) & ~on_line) | (on_line & same_dir))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = -num / den
+    t_in = np.where(~parallel & (den > 0), t, 0.0).max(axis=2)
+    t_out = np.where(~parallel & (den < 0), t, 1.0).min(axis=2)
+    t_in = np.clip(t_in, 0.0, 1.0)
+    t_out = np.clip(t_out, 0.0, 1.0)
+    valid = ~outside.any(axis=2) & (t_out > t_in)
+    x0, y0 = px + t_in * dx, py + t_in * dy
+    x1, y1 = px + t_out * dx, py + t_out * dy
+    return np.where(valid, x0 * y1 - x1 * y0, 0.0).sum(axis=1)
+
+
+def _counter_clockwise(corners):
+    flip = _polygon_area(corners) < 0
+    return np.where(flip[:, None, None], corners[:, ::-1, :], corners)
+
+
+def quad_intersection_area(a, b):
+    """
+    兩組凸四邊形逐對的交集面積，a, b 皆為 (P, 4, 2)。
+    交集的邊界由「a 在 b 內的邊段」與「b 在 a 內的邊段」組成，
+    以 Green 定理加總兩者的邊界積分即得面積，全程無 Python 迴圈與排序。
+    """
+    if len(a) == 0:
+        return np.zeros(0)
+    # 平移到各自的局部座標，避免大座標相乘造成精度損失
+    origin = a[:, :1, :]
+    a = _counter_clockwise(a - origin)
+    b = _counter_clockwise(b - origin)
+    total = _clipped_edge_integral(a, b, True) + _clipped_edge_integral(b, a, False)
+    return np.clip(0.5 * total, 0.0, None)
+
+
+def rotated_iou(a, b):
+    """兩組凸四邊形逐對的 IoU，a, b 皆為 (P, 4, 2)。"""
+    inter = quad_intersection_area(a, b)
+    union = np.abs(_polygon_area(a)) + np.abs(_polygon_area(b)) - inter
+    return np.where(union > _EPS, inter / np.maximum(union, _EPS), 0.0)
+
+
+def _expand_ranges(starts, counts):
+    """把每個 [start, start + count) 區間展開成一維索引，並回傳所屬區間編號。"""
+    total = int(counts.sum())
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
+
+
+def _aabb_overlap_pairs(mins, maxs):
+    """
+    以均勻網格找出外接矩形重疊的 (i, j) 配對，i < j。
+    網格邊長取最大外接矩形邊長，重疊的框必定落在相同或相鄰格子，
+    因此只需比對每格與其右、下方向的 4 個鄰格。
+    """
+    n = len(mins)
+    empty = np.zeros(0, dtype=np.int64)
+    if n < 2:
+        return empty, empty
+    cell = max(float((maxs - mins).max()), 1.0)
+    cells = np.floor((mins - mins.min(axis=0)) / cell).astype(np.int64)
+    width = int(cells[:, 0].max()) + 3
+    keys = (cells[:, 1] + 1) * width + (cells[:, 0] + 1)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    pairs_i, pairs_j = [], []
+    for dx, dy in ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+        target = sorted_keys + dy * width + dx
+        lo = np.searchsorted(sorted_keys, target, side="left")
+        hi = np.searchsorted(sorted_keys, target, side="right")
+        if dx == 0 and dy == 0:
+            # 同一格內只取排序後位於自己之後的框，避免重複配對
+            lo = np.maximum(lo, np.arange(n) + 1)
+        counts = np.maximum(hi - lo, 0)
+        # 依配對數量分段展開，避免一次配置過大的陣列
+        cum = np.cumsum(counts)
+        start = 0
+        while start < n:
+            base = cum[start - 1] if start > 0 else 0
+            stop = int(np.searchsorted(cum, base + _IOU_CHUNK_PAIRS, side="right"))
+            stop = min(max(stop, start + 1), n)
+            owner, q = _expand_ranges(lo[start:stop], counts[start:stop])
+            a = order[start + owner]
+            b = order[q]
+            overlap = (
+                (mins[a, 0] < maxs[b, 0]) & (mins[b, 0] < maxs[a, 0])
+                & (mins[a, 1] < maxs[b, 1]) & (mins[b, 1] < maxs[a, 1])
+            )
+            a, b = a[overlap], b[overlap]
+            pairs_i.append(np.minimum(a, b))
+            pairs_j.append(np.maximum(a, b))
+            start = stop
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+def rotated_nms(obbs, scores, iou_threshold=0.5, class_ids=None):
+    """
+    旋轉框 NMS。obbs 為 (N, 5) 的 [cx, cy, w, h, angle(弧度)]，
+    回傳保留下來的索引（依分數由高到低）。
+    只有外接矩形重疊的配對才計算旋轉 IoU；指定 class_ids 時僅在同類別間抑制。
+    """
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    n = len(scores)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    order = np.argsort(-scores, kind="stable")
+    obbs = np.asarray(obbs, dtype=np.float64).reshape(-1, 5)[order]
+    corners = obb_corners(obbs)
+    if class_ids is not None:
+        # 不同類別平移到互不重疊的區域，讓同一次計算只抑制同類別
+        span = np.ptp(corners.reshape(-1, 2), axis=0).max() + 1.0
+        cls = np.asarray(class_ids)[order].astype(np.float64)
+        corners = corners + (cls * span * 2.0)[:, None, None] * np.array([1.0, 0.0])
+
+    mins = corners.min(axis=1)
+    maxs = corners.max(axis=1)
+    pair_i, pair_j = _aabb_overlap_pairs(mins, maxs)
+
+    # 旋轉框交集不會大於外接矩形交集，先用此上界排除不可能超過門檻的配對
+    areas = np.abs(obbs[:, 2] * obbs[:, 3])
+    inter_w = np.minimum(maxs[pair_i, 0], maxs[pair_j, 0]) - np.maximum(mins[pair_i, 0], mins[pair_j, 0])
+    inter_h = np.minimum(maxs[pair_i, 1], maxs[pair_j, 1]) - np.maximum(mins[pair_i, 1], mins[pair_j, 1])
+    bound_inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    bound_inter = np.minimum(bound_inter, np.minimum(areas[pair_i], areas[pair_j]))
+    bound_union = np.maximum(areas[pair_i] + areas[pair_j] - bound_inter, _EPS)
+    possible = bound_inter / bound_union > iou_threshold
+    pair_i, pair_j = pair_i[possible], pair_j[possible]
+
+    over_i, over_j = [], []
+    for start in range(0, len(pair_i), _IOU_CHUNK_PAIRS):
+        i = pair_i[start:start + _IOU_CHUNK_PAIRS]
+        j = pair_j[start:start + _IOU_CHUNK_PAIRS]
+        mask = rotated_iou(corners[i], corners[j]) > iou_threshold
+        over_i.append(i[mask])
+        over_j.append(j[mask])
+
+    suppressed = np.zeros(n, dtype=bool)
+    if over_i:
+        over_i = np.concatenate(over_i)
+        over_j = np.concatenate(over_j)
+        by_i = np.argsort(over_i, kind="stable")
+        over_i, over_j = over_i[by_i], over_j[by_i]
+        heads, starts = np.unique(over_i, return_index=True)
+        ends = np.append(starts[1:], len(over_i))
+        # 只有彼此重疊的框需要依序處理，其餘框直接保留
+        for head, s, e in zip(heads, starts, ends):
+            if not suppressed[head]:
+                suppressed[over_j[s:e]] = True
+    return order[~suppressed]
+
+
+def allowed_class_ids(names, allowed_classes):
+    """由類別名稱清單換算成類別編號陣列；allowed_classes 為 None 時回傳 None（不過濾）。"""
+    if allowed_classes is None:
+        return None
+    if names is None:
+        return np.array([int(c) for c in allowed_classes if str(c).isdigit()], dtype=np.int64)
+    allowed = set(allowed_classes)
+    return np.array([cid for cid, name in names.items() if name in allowed], dtype=np.int64)
+
+
+def postprocess_obb_batch(obb_arrays, offsets, class_ids=None, conf_threshold=0.0, scale=1.0):
+    """
+    將一批 tile 的 OBB 陣列合併為全域座標的 (M, 7) 陣列 [cx, cy, w, h, angle, conf, cls]：
+    以整個陣列完成類別遮罩、信心度門檻與 tile 偏移，不建立任何 Python 物件。
+    offsets 為每個 tile 的 (left, top)，scale 為解碼影像相對原始影像的倍率。
+    """
+    counts = [len(a) for a in obb_arrays]
+    if not sum(counts):
+        return np.zeros((0, 7), dtype=np.float64)
+    obb = np.concatenate([np.asarray(a, dtype=np.float64).reshape(-1, 7) for a in obb_arrays])
+    shift = np.repeat(np.asarray(offsets, dtype=np.float64).reshape(-1, 2), counts, axis=0)
+
+    keep = obb[:, 5] >= conf_threshold
+    if class_ids is not None:
+        keep &= np.isin(obb[:, 6].astype(np.int64), class_ids)
+    obb = obb[keep]
+    obb[:, :2] += shift[keep]
+    obb[:, :4] *= scale
+    return obb
+
+
+def obbs_to_bboxes(obb, names):
+    """序列化：(M, 7) OBB 陣列轉為 API 回傳的 bbox dict 列表。"""
+    class_ids = obb[:, 6].astype(np.int64).tolist()
+    values = obb[:, :6].tolist()
+    return [
+        {
+            "class_name": names[cid] if names is not None else str(cid),
+            "class_id": cid,
+            "obb": row,
+        }
+        for cid, row in zip(class_ids, values)
+    ]
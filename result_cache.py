@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# 上傳檔案以固定大小分段讀取，邊寫入磁碟邊計算雜湊
+_CHUNK_SIZE = 1024 * 1024
+# 超過此時間仍未完成的暫存上傳視為殘留檔
+_STALE_UPLOAD_SECONDS = 3600
+
+DETECTIONS_FILE = "detections.json"
+SOURCE_FILE = "source"
+ANNOTATED_FILE = "annotated.jpg"
+
+
+def make_result_key(image_digest, model_name, allowed_classes, tile_params):
+    """
+    偵測結果的內容定址 key：影像雜湊 + 模型名稱 + 類別清單 + tiling 參數。
+    """
+    payload = json.dumps(
+        {
+            "image": image_digest,
+            "model": model_name,
+            "classes": sorted(allowed_classes) if allowed_classes is not None else None,
+            "tiling": tile_params,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    以磁碟目錄保存偵測結果（detections.json / source / annotated.jpg），
+    每個 key 一個目錄，總容量超過 max_bytes 時依最近使用時間（LRU）淘汰。
+    目錄的 mtime 即為最近使用時間，因此重啟後仍能延續 LRU 順序。
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> 佔用位元組數，由舊到新
+        self._total = 0
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith("tmp-"):
+                # 清除上次未完成的暫存上傳；同目錄可能被其他行程共用，只刪除夠舊的檔案
+                if time.time() - os.path.getmtime(path) > _STALE_UPLOAD_SECONDS:
+                    os.remove(path)
+                continue
+            if os.path.isdir(path) and os.path.exists(os.path.join(path, DETECTIONS_FILE)):
+                entries.append((os.path.getmtime(path), name, self._dir_size(path)))
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+            self._total += size
+
+    @staticmethod
+    def _dir_size(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def file_path(self, key, filename):
+        return os.path.join(self.root, key, filename)
+
+    def stage_upload(self, stream):
+        """
+        將上傳串流寫入暫存檔並計算 sha256，回傳 (暫存檔路徑, 影像雜湊)。
+        """
+        digest = hashlib.sha256()
+        tmp_path = os.path.join(self.root, f"tmp-{uuid.uuid4().hex}")
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = stream.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+        return tmp_path, digest.hexdigest()
+
+    def discard_upload(self, tmp_path):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    def get(self, key):
+        """命中時回傳偵測結果 dict 並更新 LRU 順序，否則回傳 None。"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self.file_path(key, DETECTIONS_FILE), encoding="utf-8") as f:
+                result = json.load(f)
+            os.utime(self.entry_dir(key))
+        except (OSError, ValueError):
+            self._drop(key)
+            return None
+        return result
+
+    def put(self, key, source_tmp_path, result):
+        """保存一筆新的偵測結果，source_tmp_path 會被移入該筆結果的目錄。"""
+        entry_dir = self.entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        os.replace(source_tmp_path, os.path.join(entry_dir, SOURCE_FILE))
+        tmp_json = os.path.join(entry_dir, f"tmp-{uuid.uuid4().hex}")
+        with open(tmp_json, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        os.replace(tmp_json, os.path.join(entry_dir, DETECTIONS_FILE))
+        self._account(key)
+
+    def add_file(self, key, filename, write_fn):
+        """以 write_fn(path) 產生該筆結果的附加檔案（例如標註影像），寫入後重新計算容量。"""
+        tmp_path = self.file_path(key, f"tmp-{uuid.uuid4().hex}-{filename}")
+        write_fn(tmp_path)
+        os.replace(tmp_path, self.file_path(key, filename))
+        self._account(key)
+
+    def _account(self, key):
+        size = self._dir_size(self.entry_dir(key))
+        with self._lock:
+            self._total += size - self._entries.get(key, 0)
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            evicted = []
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            shutil.rmtree(self.entry_dir(old_key), ignore_errors=True)
+
+    def _drop(self, key):
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self._total -= size
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
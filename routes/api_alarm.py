@@ -1,28 +1,296 @@
-from flask import Blueprint, request, jsonify
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from flask import Blueprint, Response, request, jsonify
+from sqlalchemy import Column, Integer, String, Text, DateTime, delete, func, insert, inspect, select, text, update
+from sqlalchemy.exc import OperationalError
 from datetime import datetime
 from config import make_engine_and_session
-import json, os
+from zone_geometry import geometry_polygons, polygons_bbox, polygons_contain, polygons_edges, zones_containing_points
+from geojson_codec import dumps_compact
+import hashlib, json, os
+import numpy as np
 
 api_alarm = Blueprint("api_alarm", __name__)
 
 # === 初始化資料庫 ===
 # 使用「這個檔案」的相對路徑，確保無論在哪執行都能正確找到資料庫
 db_path = os.path.join(os.path.dirname(__file__), "../db/alarm_zones.db")
-engine, Session, Base = make_engine_and_session(db_path)
+# WAL + synchronous=NORMAL：讀取（前端輪詢、批次判斷）不再擋住寫入，commit 也不必每次 fsync
+engine, Session, Base = make_engine_and_session(
+    db_path,
+    journal_mode=os.environ.get("ALARM_DB_JOURNAL_MODE", "WAL"),
+    synchronous=os.environ.get("ALARM_DB_SYNCHRONOUS", "NORMAL"),
+    mmap_size=int(os.environ.get("ALARM_DB_MMAP_SIZE", 64 * 1024 * 1024)),
+    cache_size=int(os.environ.get("ALARM_DB_CACHE_SIZE", -16000)),
+    busy_timeout=int(os.environ.get("ALARM_DB_BUSY_TIMEOUT_MS", 5000)),
+)
 
 
 class AlarmZone(Base):
     __tablename__ = "alarm_zones"
     id = Column(Integer, primary_key=True)
-    name = Column(String(100))
+    name = Column(String(100), index=True)
     geojson = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
+    revision = Column(Integer, index=True)  # 最後一次新增 / 更新時的修訂號
+
+
+class AlarmZoneTombstone(Base):
+    """已刪除警戒區的紀錄，讓增量同步的客戶端知道要移除哪些警戒區。"""
+    __tablename__ = "alarm_zone_tombstones"
+    id = Column(Integer, primary_key=True)  # 被刪除的 alarm_zones.id
+    revision = Column(Integer, index=True, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
+
+
+class AlarmZoneRevision(Base):
+    """單列的修訂號計數器；每次寫入先遞增它，取得寫入鎖的同時也取得唯一且遞增的修訂號。"""
+    __tablename__ = "alarm_zone_revision"
+    id = Column(Integer, primary_key=True)
+    revision = Column(Integer, nullable=False, default=0)
 
 
 Base.metadata.create_all(engine)
 
 
+def _migrate_revisions():
+    """舊資料庫補上 revision 欄位與計數器；既有警戒區的修訂號視為 1。"""
+    columns = {column["name"] for column in inspect(engine).get_columns("alarm_zones")}
+    with engine.begin() as conn:
+        if "revision" not in columns:
+            conn.execute(text("ALTER TABLE alarm_zones ADD COLUMN revision INTEGER"))
+        conn.execute(text("UPDATE alarm_zones SET revision = 1 WHERE revision IS NULL"))
+        if conn.execute(select(AlarmZoneRevision.id)).first() is None:
+            current = conn.execute(select(func.max(AlarmZone.revision))).scalar() or 0
+            conn.execute(insert(AlarmZoneRevision).values(id=1, revision=current))
+
+
+_migrate_revisions()
+# create_all 不會替既有的資料表補上索引（upsert 以名稱查詢、增量同步以修訂號查詢）
+for _index in AlarmZone.__table__.indexes:
+    _index.create(engine, checkfirst=True)
+
+
+def _next_revision(session):
+    return session.execute(
+        update(AlarmZoneRevision)
+        .where(AlarmZoneRevision.id == 1)
+        .values(revision=AlarmZoneRevision.revision + 1)
+        .returning(AlarmZoneRevision.revision)
+    ).scalar_one()
+
+
+def _current_revision(session):
+    return session.execute(select(AlarmZoneRevision.revision).where(AlarmZoneRevision.id == 1)).scalar_one()
+
+
+def _zone_feature(zone_id, geojson_str, revision):
+    """解析儲存的 Feature 並補上 id 與修訂號；內容無法解析時回傳 None。"""
+    try:
+        f = json.loads(geojson_str)
+        f["properties"]["id"] = zone_id
+        f["properties"]["revision"] = revision
+        return f
+    except Exception:
+        return None
+
+
+# === 警戒區空間索引 ===
+# SQLite rtree 虛擬表存放每個警戒區的外框（id 與 alarm_zones.id 相同），
+# 查詢「哪些警戒區包含此點」時先以外框篩出候選，再做精確的點在多邊形內判斷
+RTREE_TABLE = "alarm_zones_rtree"
+
+
+def _create_rtree():
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} "
+                "USING rtree(id, min_lon, max_lon, min_lat, max_lat)"
+            ))
+        return True
+    except OperationalError as e:
+        # SQLite 未編入 rtree 模組時退回逐筆比對外框
+        print("⚠️ 無法建立警戒區空間索引，改為逐筆比對:", e)
+        return False
+
+
+RTREE_ENABLED = _create_rtree()
+
+
+def _feature_polygons(feature):
+    try:
+        return geometry_polygons(feature.get("geometry"))
+    except (ValueError, TypeError, AttributeError, IndexError):
+        return []
+
+
+def _zone_polygons(geojson_str):
+    try:
+        feature = json.loads(geojson_str)
+    except (ValueError, TypeError):
+        return []
+    return _feature_polygons(feature) if isinstance(feature, dict) else []
+
+
+def _index_zones(session, zones):
+    """
+    在同一個 transaction 中寫入（或更新）一批警戒區的外框，zones 為 [(zone_id, polygons), ...]
+    （polygons 同 geometry_polygons 的回傳）；沒有多邊形的警戒區不建索引。
+    """
+    if not RTREE_ENABLED or not zones:
+        return
+    rows = []
+    for zone_id, polygons in zones:
+        bbox = polygons_bbox(polygons)
+        if bbox is not None:
+            rows.append({"id": zone_id, "min_lon": bbox[0], "min_lat": bbox[1], "max_lon": bbox[2], "max_lat": bbox[3]})
+    session.execute(text(f"DELETE FROM {RTREE_TABLE} WHERE id = :id"), [{"id": zone_id} for zone_id, _ in zones])
+    if rows:
+        session.execute(
+            text(f"INSERT INTO {RTREE_TABLE} (id, min_lon, max_lon, min_lat, max_lat) "
+                 "VALUES (:id, :min_lon, :max_lon, :min_lat, :max_lat)"),
+            rows,
+        )
+
+
+def _unindex_zone(session, zone_id):
+    if RTREE_ENABLED:
+        session.execute(text(f"DELETE FROM {RTREE_TABLE} WHERE id = :id"), {"id": zone_id})
+
+
+def _sync_rtree():
+    """啟動時補上索引：建立索引前已存在的警戒區，以及索引中已不存在的警戒區。"""
+    if not RTREE_ENABLED:
+        return
+    session = Session()
+    try:
+        missing = session.execute(text(
+            f"SELECT id, geojson FROM alarm_zones WHERE id NOT IN (SELECT id FROM {RTREE_TABLE})"
+        )).all()
+        _index_zones(session, [(zone_id, _zone_polygons(geojson_str)) for zone_id, geojson_str in missing])
+        session.execute(text(f"DELETE FROM {RTREE_TABLE} WHERE id NOT IN (SELECT id FROM alarm_zones)"))
+        session.commit()
+    finally:
+        session.close()
+
+
+_sync_rtree()
+
+
+# === 警戒區快取 ===
+# 快取以資料庫中的修訂號為 key：每次儲存 / 刪除都會遞增修訂號，
+# 多行程部署時其他行程的寫入也能在下次讀取時察覺，只需多讀一列
+_zone_collection_cache = (-1, None, b"", "")  # (修訂號, FeatureCollection, JSON bytes, ETag)
+_zone_rings_cache = (-1, [])  # (修訂號, [(zone_id, bbox, edges), ...])
+
+# 批次判斷一次最多接受的點位數
+EVALUATE_MAX_POSITIONS = int(os.environ.get("ALARM_EVALUATE_MAX_POSITIONS", 200000))
+
+
+def get_zone_collection():
+    """
+    回傳 (修訂號, FeatureCollection, 序列化後的 JSON bytes, ETag)，修訂號有變動時才重新讀取。
+    FeatureCollection 由所有請求共用，呼叫端不可修改；其 revision 欄位可做為增量同步的起點。
+    """
+    global _zone_collection_cache
+    session = Session()
+    try:
+        # pysqlite 的 SELECT 不在同一個 transaction 內，兩次讀取之間可能有其他寫入；
+        # 先讀修訂號再讀資料，資料只會比修訂號新，該寫入遞增的修訂號會讓下次呼叫重新讀取
+        revision = _current_revision(session)
+        cached = _zone_collection_cache
+        if cached[0] == revision:
+            return cached
+        rows = session.query(AlarmZone.id, AlarmZone.geojson, AlarmZone.revision).order_by(AlarmZone.id).all()
+    finally:
+        session.close()
+    features = [f for f in (_zone_feature(*row) for row in rows) if f is not None]
+    collection = {"type": "FeatureCollection", "revision": revision, "features": features}
+    body = dumps_compact(collection).encode("utf-8")
+    # ETag 取內容雜湊而非修訂號：同一修訂號下讀到的資料可能較新，內容雜湊才能反映實際回傳內容
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    _zone_collection_cache = (revision, collection, body, etag)
+    return _zone_collection_cache
+
+
+def get_zone_rings():
+    """回傳 (修訂號, [(zone_id, bbox, edges), ...])（依 id 排序），由 get_zone_collection 的結果前處理。"""
+    global _zone_rings_cache
+    revision, collection, _, _ = get_zone_collection()
+    cached_revision, zones = _zone_rings_cache
+    if cached_revision == revision:
+        return revision, zones
+    zones = []
+    for feature in collection["features"]:
+        polygons = _feature_polygons(feature)
+        if polygons:
+            zones.append((feature["properties"]["id"], polygons_bbox(polygons), polygons_edges(polygons)))
+    _zone_rings_cache = (revision, zones)
+    return revision, zones
+
+
+# 以名稱查詢既有警戒區時，每次 IN 查詢的名稱數（低於 SQLite 參數數量上限）
+UPSERT_LOOKUP_CHUNK = 500
+
+
+def upsert_zones(session, features):
+    """
+    以名稱 upsert 一整個 FeatureCollection：已存在的名稱更新 geojson（同名有多筆時更新 id 最小者），
+    其餘整批新增，rtree 索引一併更新。同一批中名稱重複時以最後一筆為準。
+    整批寫入共用一個新的修訂號。回傳 (新增數, 更新數)，由呼叫端 commit。
+    """
+    by_name = {}
+    for f in features:
+        by_name[f["properties"].get("name", "未命名")] = f
+    names = list(by_name)
+
+    # 先遞增修訂號取得寫入鎖（pysqlite 遇到 DML 才送出 BEGIN），之後的名稱查詢才在同一個寫入
+    # transaction 內；否則兩個同時儲存同名新警戒區的請求都會查不到而各自新增
+    revision = _next_revision(session)
+    existing = {}
+    for start in range(0, len(names), UPSERT_LOOKUP_CHUNK):
+        chunk = names[start:start + UPSERT_LOOKUP_CHUNK]
+        existing.update(session.execute(
+            select(AlarmZone.name, func.min(AlarmZone.id)).where(AlarmZone.name.in_(chunk)).group_by(AlarmZone.name)
+        ).all())
+
+    updates, inserts = [], []
+    for name in names:
+        geojson_str = dumps_compact(by_name[name])
+        if name in existing:
+            updates.append({"id": existing[name], "geojson": geojson_str, "revision": revision})
+        else:
+            inserts.append({"name": name, "geojson": geojson_str, "revision": revision})
+    if updates:
+        session.execute(update(AlarmZone), updates)
+    inserted_ids = []
+    if inserts:
+        inserted_ids = session.scalars(
+            insert(AlarmZone).returning(AlarmZone.id, sort_by_parameter_order=True), inserts
+        ).all()
+        # SQLite 可能重用已刪除的最大 id，新增的警戒區不能同時留著舊的刪除紀錄
+        session.execute(delete(AlarmZoneTombstone).where(AlarmZoneTombstone.id.in_(inserted_ids)))
+    zone_ids = {name: existing[name] for name in names if name in existing}
+    zone_ids.update((row["name"], zone_id) for zone_id, row in zip(inserted_ids, inserts))
+    _index_zones(session, [(zone_ids[name], _feature_polygons(by_name[name])) for name in names])
+    return len(inserts), len(updates)
+
+
+def find_zones_containing(session, lon, lat):
+    """回傳包含 (lon, lat) 的警戒區 [(id, name), ...]，依 id 排序。"""
+    if RTREE_ENABLED:
+        candidates = session.execute(text(
+            f"SELECT z.id, z.name, z.geojson FROM alarm_zones z JOIN {RTREE_TABLE} r ON r.id = z.id "
+            "WHERE r.min_lon <= :lon AND r.max_lon >= :lon AND r.min_lat <= :lat AND r.max_lat >= :lat "
+            "ORDER BY z.id"
+        ), {"lon": lon, "lat": lat}).all()
+    else:
+        candidates = session.query(AlarmZone.id, AlarmZone.name, AlarmZone.geojson).order_by(AlarmZone.id).all()
+    return [
+        (zone_id, name)
+        for zone_id, name, geojson_str in candidates
+        if polygons_contain(_zone_polygons(geojson_str), lon, lat)
+    ]
+
 
 # === 儲存警戒範圍 API ===
 @api_alarm.route("/api/save_alarm_zones", methods=["POST"])
@@ -32,14 +300,17 @@ def save_alarm_zones():
         if not data or data.get("type") != "FeatureCollection":
             return "Invalid GeoJSON format", 400
 
+        # 同名警戒區覆寫而非重複新增，整批在同一個 transaction 內完成
         session = Session()
-        for f in data["features"]:
-            name = f["properties"].get("name", "未命名")
-            geojson_str = json.dumps(f, ensure_ascii=False)
-            session.add(AlarmZone(name=name, geojson=geojson_str))
-        session.commit()
-        session.close()
-        return jsonify({"status": "success"}), 200
+        try:
+            inserted, updated = upsert_zones(session, data["features"])
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        return jsonify({"status": "success", "inserted": inserted, "updated": updated}), 200
     except Exception as e:
         print("❌ 儲存警戒區錯誤:", e)
         return str(e), 500
@@ -47,18 +318,12 @@ def save_alarm_zones():
 # === 取得所有警戒區 ===
 @api_alarm.route("/api/get_alarm_zones", methods=["GET"])
 def get_alarm_zones():
-    session = Session()
-    zones = session.query(AlarmZone).all()
-    data = []
-    for z in zones:
-        try:
-            f = json.loads(z.geojson)
-            f["properties"]["id"] = z.id
-            data.append(f)
-        except Exception:
-            continue
-    session.close()
-    return jsonify({"type": "FeatureCollection", "features": data}), 200
+    # 內容未變動時（If-None-Match 與 ETag 相同）回傳 304，不帶內容
+    _, _, body, etag = get_zone_collection()
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
 
 
 # === 刪除指定警戒區 ===
@@ -70,6 +335,92 @@ def delete_alarm_zone(zone_id):
         session.close()
         return jsonify({"error": "not found"}), 404
     session.delete(zone)
+    _unindex_zone(session, zone_id)
+    session.merge(AlarmZoneTombstone(id=zone_id, revision=_next_revision(session), deleted_at=datetime.utcnow()))
     session.commit()
     session.close()
     return jsonify({"status": "deleted"}), 200
+
+
+# === 查詢包含指定座標的警戒區 ===
+@api_alarm.route("/api/alarm_zones/containing", methods=["GET"])
+def get_zones_containing():
+    try:
+        lon = float(request.args["lon"])
+        lat = float(request.args["lat"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "lon 與 lat 為必填數值"}), 400
+    session = Session()
+    try:
+        zones = find_zones_containing(session, lon, lat)
+    finally:
+        session.close()
+    return jsonify({
+        "lon": lon,
+        "lat": lat,
+        "zones": [{"id": zone_id, "name": name} for zone_id, name in zones],
+    }), 200
+
+
+# === 批次判斷大量船位落在哪些警戒區 ===
+@api_alarm.route("/api/alarm_zones/evaluate", methods=["POST"])
+def evaluate_positions():
+    """
+    請求：{"lon": [...], "lat": [...]}（長度相同的經緯度陣列）
+    回應：{"count": N, "revision": 警戒區修訂號, "zones": [[zone_id, ...], ...]}，與輸入順序對應
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        lons = np.asarray(data["lon"], dtype=np.float64)
+        lats = np.asarray(data["lat"], dtype=np.float64)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "lon 與 lat 必須是數值陣列"}), 400
+    if lons.ndim != 1 or lons.shape != lats.shape:
+        return jsonify({"error": "lon 與 lat 必須是長度相同的一維陣列"}), 400
+    if lons.size > EVALUATE_MAX_POSITIONS:
+        return jsonify({"error": f"一次最多 {EVALUATE_MAX_POSITIONS} 個點位"}), 413
+    if not (np.isfinite(lons).all() and np.isfinite(lats).all()):
+        return jsonify({"error": "lon 與 lat 不可包含 NaN 或無限值"}), 400
+
+    revision, zone_rings = get_zone_rings()
+    zones = zones_containing_points(lons, lats, zone_rings)
+    return Response(
+        dumps_compact({"count": int(lons.size), "revision": revision, "zones": zones}),
+        mimetype="application/json",
+    )
+
+
+# === 增量同步：取得指定修訂號之後的變動 ===
+@api_alarm.route("/api/alarm_zones/changes", methods=["GET"])
+def get_alarm_zone_changes():
+    """
+    GET /api/alarm_zones/changes?since=<修訂號>
+    回應：{"revision": 目前修訂號, "upserted": [新增或更新的 Feature], "deleted": [已刪除的 id]}
+    客戶端先以 get_alarm_zones 的 revision（或 0）為起點，之後以回應的 revision 繼續輪詢。
+    """
+    try:
+        since = int(request.args.get("since", 0))
+    except ValueError:
+        return jsonify({"error": "since 必須是整數"}), 400
+    if since < 0:
+        return jsonify({"error": "since 不可為負數"}), 400
+
+    session = Session()
+    try:
+        revision = _current_revision(session)
+        if since >= revision:
+            rows, deleted = [], []
+        else:
+            rows = session.query(AlarmZone.id, AlarmZone.geojson, AlarmZone.revision).filter(
+                AlarmZone.revision > since
+            ).order_by(AlarmZone.id).all()
+            deleted = session.scalars(
+                select(AlarmZoneTombstone.id).where(AlarmZoneTombstone.revision > since).order_by(AlarmZoneTombstone.id)
+            ).all()
+    finally:
+        session.close()
+    upserted = [f for f in (_zone_feature(*row) for row in rows) if f is not None]
+    return Response(
+        dumps_compact({"revision": revision, "upserted": upserted, "deleted": deleted}),
+        mimetype="application/json",
+    )
@@ -0,0 +1,249 @@
+import os
+from PIL import Image
+
+# 超大衛星影像（例如 30k×30k）會超過 PIL 預設的 decompression bomb 上限，
+# 這裡改由環境變數控制，預設放寬到 20 億像素；
+# 只有能視窗解碼或 draft 縮小解碼的格式才會用到這麼大的上限，整張解碼另由 MAX_DECODE_PIXELS 把關
+Image.MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 2_000_000_000))
+
+# 單次解碼允許的最大像素數；超過時改用視窗解碼或 JPEG draft 縮小解碼，
+# 兩者都不支援的格式（壓縮 TIFF、PNG 等）超過此值直接拒絕。
+# 預設沿用 PIL 原本的 decompression bomb 上限（2 × 89,478,485），原本能處理的影像不會被拒絕
+MAX_DECODE_PIXELS = int(os.environ.get("MAX_DECODE_PIXELS", 178_956_970))
+
+# render_base 每次解碼的列帶像素數上限（整列寬度 × 列數）
+RENDER_BAND_PIXELS = 32_000_000
+
+# JPEG draft mode 支援的 DCT 縮放倍率
+_JPEG_DRAFT_SCALES = (1, 2, 4, 8)
+
+
+class ImageTooLargeError(ValueError):
+    """影像只能整張解碼，且像素數超過 MAX_DECODE_PIXELS。"""
+
+
+def _tile_origins(length, tile_size, step):
+    """
+    沿單一軸向的 tile 起點；最後一個 tile 向內對齊影像邊界，
+    讓每個 tile 都是完整尺寸（影像比 tile 小時只有一個起點 0）。
+    """
+    if length <= tile_size:
+        return [0]
+    origins = list(range(0, length - tile_size, step))
+    origins.append(length - tile_size)
+    return origins
+
+
+def iter_tile_boxes(width, height, tile_size, overlap):
+    """
+    依序產生每個 tile 的 (left, top, right, bottom)，不做任何解碼。
+    相鄰 tile 至少重疊 overlap 像素。
+    """
+    step = tile_size - overlap
+    if step <= 0:
+        raise ValueError("overlap 必須小於 tile_size")
+    for top in _tile_origins(height, tile_size, step):
+        for left in _tile_origins(width, tile_size, step):
+            right = min(left + tile_size, width)
+            bottom = min(top + tile_size, height)
+            yield left, top, right, bottom
+
+
+def iter_image_tiles(image, tile_size, overlap):
+    """
+    對已開啟的 PIL 影像逐一 crop tile，一次只持有一個 tile。
+    """
+    width, height = image.size
+    for box in iter_tile_boxes(width, height, tile_size, overlap):
+        yield image.crop(box), box[0], box[1]
+
+
+def iter_batches(iterable, batch_size):
+    """將任意 iterable 切成固定大小的 list 批次（最後一批可能較小）。"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _boxes_intersect(a, b):
+    return a[0] < b[2] and a[2] > b[0] and a[1] < b[3] and a[3] > b[1]
+
+
+# 可以直接依列切片的未壓縮 raw 格式，每像素位元組數
+_RAW_BYTES_PER_PIXEL = {"L": 1, "P": 1, "LA": 2, "RGB": 3, "RGBA": 4, "RGBX": 4, "CMYK": 4}
+
+
+def _row_stride(tile):
+    """由上而下排列的未壓縮 raw 區塊回傳每列位元組數，其他情況回傳 None。"""
+    codec, extents, _, args = tile
+    if codec != "raw" or not isinstance(args, tuple) or len(args) < 3:
+        return None
+    rawmode, stride, orientation = args[:3]
+    if orientation != 1 or rawmode not in _RAW_BYTES_PER_PIXEL:
+        return None
+    return stride or (extents[2] - extents[0]) * _RAW_BYTES_PER_PIXEL[rawmode]
+
+
+def _tile_with(tile, extents, offset):
+    """
+    以新的範圍與位移建立區塊描述子。Pillow 11 起描述子為 ImageFile._Tile（namedtuple），
+    load() 會讀取 .offset 屬性，必須保留原型別；舊版為一般 tuple。
+    """
+    if hasattr(tile, "_replace"):
+        return tile._replace(extents=extents, offset=offset)
+    return (tile[0], extents, offset, tile[3])
+
+
+def _clip_tile_rows(tile, top, bottom):
+    """
+    將一個 raw 區塊裁成只涵蓋 [top, bottom) 列的描述子，
+    例如 Pillow 寫出的單一 strip 未壓縮 TIFF 也能只讀需要的列。
+    """
+    stride = _row_stride(tile)
+    _, (x0, y0, x1, y1), offset, _ = tile
+    if stride is None:
+        return tile
+    new_y0 = max(y0, top)
+    new_y1 = min(y1, bottom)
+    return _tile_with(tile, (x0, new_y0, x1, new_y1), offset + (new_y0 - y0) * stride)
+
+
+class TiledImageReader:
+    """
+    以視窗方式讀取大型影像，依影像格式選擇解碼策略：
+      - window：未壓縮的 tiled / striped TIFF（含 GeoTIFF），每個視窗只解碼相交的區塊
+      - draft ：超過 MAX_DECODE_PIXELS 的 JPEG，以 DCT draft mode 縮小解碼
+      - full  ：其他格式只能整張解碼一次，之後逐一 crop
+
+    iter_tiles() 回傳的 left / top 與 tile 都在「解碼後」座標系，
+    乘上 self.scale 即可換算回原始影像座標。
+    """
+
+    def __init__(self, fp, max_decode_pixels=MAX_DECODE_PIXELS):
+        self._fp = fp
+        self.max_decode_pixels = max_decode_pixels
+        image = Image.open(fp)
+        self.size = image.size  # 原始影像尺寸
+        self.format = image.format
+        self.scale = 1.0
+        self._image = None
+
+        if self._supports_window_decode(image):
+            self.strategy = "window"
+            self.decoded_size = image.size
+            return
+
+        width, height = image.size
+        if image.format == "JPEG" and width * height > max_decode_pixels:
+            scale = _JPEG_DRAFT_SCALES[-1]
+            for s in _JPEG_DRAFT_SCALES:
+                if (width / s) * (height / s) <= max_decode_pixels:
+                    scale = s
+                    break
+            image.draft("RGB", (-(-width // scale), -(-height // scale)))
+            self.strategy = "draft"
+        else:
+            if width * height > max_decode_pixels:
+                raise ImageTooLargeError(
+                    f"{image.format} 影像 {width}×{height} 超過整張解碼上限 {max_decode_pixels} 像素"
+                )
+            self.strategy = "full"
+
+        image.load()
+        self._image = image if image.mode == "RGB" else image.convert("RGB")
+        self.decoded_size = self._image.size
+        self.scale = width / self.decoded_size[0]
+
+    @staticmethod
+    def _supports_window_decode(image):
+        # 只有每個區塊各自一個 decoder 描述的 TIFF 才能部分解碼；
+        # libtiff 壓縮的 TIFF 會是單一描述子涵蓋整張影像
+        tiles = image.tile
+        if image.format != "TIFF" or not tiles:
+            return False
+        if any(t[0] == "libtiff" for t in tiles):
+            return False
+        return len(tiles) > 1 or _row_stride(tiles[0]) is not None
+
+    def _decode_window(self, box):
+        """只解碼與 box 相交的 TIFF 區塊，回傳 box 範圍的 RGB 影像。"""
+        self._fp.seek(0)
+        image = Image.open(self._fp)
+        tiles = []
+        for t in image.tile:
+            if _boxes_intersect(t[1], box):
+                tiles.append(_clip_tile_rows(t, box[1], box[3]))
+        ux0 = min(t[1][0] for t in tiles)
+        uy0 = min(t[1][1] for t in tiles)
+        ux1 = max(t[1][2] for t in tiles)
+        uy1 = max(t[1][3] for t in tiles)
+        image.tile = [
+            _tile_with(t, (t[1][0] - ux0, t[1][1] - uy0, t[1][2] - ux0, t[1][3] - uy0), t[2])
+            for t in tiles
+        ]
+        image._size = (ux1 - ux0, uy1 - uy0)
+        # 較新的 Pillow 依 _tile_size 配置 TIFF 影像記憶體，不改會配置整張影像大小
+        image._tile_size = image._size
+        image.load()
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        left, top, right, bottom = box
+        if (left, top, right, bottom) == (ux0, uy0, ux1, uy1):
+            return image
+        return image.crop((left - ux0, top - uy0, right - ux0, bottom - uy0))
+
+    def _iter_bands(self, band_height, overlap=0):
+        """依序產生 (整列寬度的列帶影像, top, bottom)，每個列帶只解碼一次。"""
+        width, height = self.decoded_size
+        step = band_height - overlap
+        for top in _tile_origins(height, band_height, step):
+            bottom = min(top + band_height, height)
+            yield self._decode_window((0, top, width, bottom)), top, bottom
+
+    def iter_tiles(self, tile_size, overlap):
+        """
+        逐一產生 (tile, left, top)。window 模式下每一列 tile 共用同一次解碼的列帶，
+        記憶體上限約為影像寬度 × tile_size。
+        """
+        if self.strategy != "window":
+            yield from iter_image_tiles(self._image, tile_size, overlap)
+            return
+        width, _ = self.decoded_size
+        step = tile_size - overlap
+        if step <= 0:
+            raise ValueError("overlap 必須小於 tile_size")
+        for band, top, bottom in self._iter_bands(tile_size, overlap):
+            for left in _tile_origins(width, tile_size, step):
+                right = min(left + tile_size, width)
+                yield band.crop((left, 0, right, bottom - top)), left, top
+
+    def render_base(self):
+        """
+        取得用於繪製標註的底圖與其相對原始影像的縮放倍率。
+        window 模式下逐列帶縮小後貼到畫布，畫布上限為 max_decode_pixels，
+        每個列帶不超過 RENDER_BAND_PIXELS。
+        """
+        if self.strategy != "window":
+            return self._image, self.scale
+
+        width, height = self.size
+        scale = max(1.0, ((width * height) / self.max_decode_pixels) ** 0.5)
+        canvas_width = max(1, int(width / scale))
+        canvas = Image.new("RGB", (canvas_width, max(1, int(height / scale))))
+        band_height = max(1, min(2048, RENDER_BAND_PIXELS // width))
+        for band, top, bottom in self._iter_bands(band_height):
+            dst_top, dst_bottom = int(top / scale), int(bottom / scale)
+            if dst_bottom > dst_top:
+                size = (canvas_width, dst_bottom - dst_top)
+                canvas.paste(band if band.size == size else band.resize(size, Image.BOX), (0, dst_top))
+        return canvas, scale
+
+    def close(self):
+        if self._image is not None:
+            self._image.close()
+            self._image = None
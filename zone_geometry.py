@@ -0,0 +1,117 @@
+import numpy as np
+
+
+def geometry_polygons(geometry):
+    """
+    將 GeoJSON Polygon / MultiPolygon 轉為 polygon 列表，每個 polygon 為 ring 陣列列表
+    （第一個為外環，其餘為洞，每個 ring 為 (n, 2) 的 [lon, lat] 陣列）；其他型別回傳空列表。
+    """
+    if not geometry:
+        return []
+    if geometry.get("type") == "Polygon":
+        polygons = [geometry.get("coordinates") or []]
+    elif geometry.get("type") == "MultiPolygon":
+        polygons = geometry.get("coordinates") or []
+    else:
+        return []
+    result = []
+    for polygon in polygons:
+        rings = [np.asarray(ring, dtype=np.float64)[:, :2] for ring in polygon if len(ring) >= 3]
+        if rings:
+            result.append(rings)
+    return result
+
+
+def polygons_bbox(polygons):
+    """回傳 (min_lon, min_lat, max_lon, max_lat)；沒有任何 ring 時回傳 None。"""
+    exteriors = [polygon[0] for polygon in polygons]
+    if not exteriors:
+        return None
+    points = np.concatenate(exteriors)
+    min_lon, min_lat = points.min(axis=0)
+    max_lon, max_lat = points.max(axis=0)
+    return float(min_lon), float(min_lat), float(max_lon), float(max_lat)
+
+
+def _ring_contains(ring, lon, lat):
+    # ray casting：往 +x 方向的射線與 ring 邊相交奇數次即在內部（一次檢查整個 ring 的所有邊）
+    x1, y1 = ring[:, 0], ring[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    crosses = (y1 > lat) != (y2 > lat)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_at = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+    return bool(np.count_nonzero(crosses & (lon < x_at)) % 2)
+
+
+def polygons_contain(polygons, lon, lat):
+    """點是否落在任一 polygon 內（在外環內且不在任何洞內）。"""
+    for rings in polygons:
+        if _ring_contains(rings[0], lon, lat) and not any(_ring_contains(hole, lon, lat) for hole in rings[1:]):
+            return True
+    return False
+
+
+def polygons_edges(polygons):
+    """
+    將所有 ring 的邊攤平成 (x1, y1, x2, y2) 四個陣列，供向量化判斷使用；
+    外環與洞放在一起以奇偶規則計算，落在洞內的點與外環、洞各交一次而判為外部。
+    """
+    rings = [ring for polygon in polygons for ring in polygon]
+    if not rings:
+        empty = np.empty(0, dtype=np.float64)
+        return empty, empty, empty, empty
+    starts = np.concatenate(rings)
+    ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+
+def points_in_edges(lons, lats, edges, max_cells=1 << 20):
+    """
+    向量化 ray casting：回傳每個點是否在 edges 圍成的區域內（bool 陣列）。
+    點數 x 邊數的中間矩陣以 max_cells 分段計算，避免大批點位一次配置過多記憶體。
+    """
+    x1, y1, x2, y2 = edges
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    inside = np.zeros(lons.shape[0], dtype=bool)
+    if x1.size == 0:
+        return inside
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (x2 - x1) / (y2 - y1)
+    step = max(1, max_cells // x1.size)
+    for start in range(0, lons.shape[0], step):
+        px = lons[start:start + step, None]
+        py = lats[start:start + step, None]
+        crosses = (y1 > py) != (y2 > py)
+        with np.errstate(invalid="ignore"):
+            hits = crosses & (px < x1 + (py - y1) * slope)
+        inside[start:start + step] = np.count_nonzero(hits, axis=1) % 2 == 1
+    return inside
+
+
+def zones_containing_points(lons, lats, zones):
+    """
+    批次判斷大量點位落在哪些警戒區內。zones 為 [(zone_id, bbox, edges), ...]，
+    回傳與輸入順序相同的 zone_id 列表的列表。
+    點位先依經度排序，每個警戒區以二分搜尋取出外框經度範圍內的點，再篩緯度，
+    只有落在外框內的點才做 ray casting。
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    result = [[] for _ in range(lons.shape[0])]
+    if not result:
+        return result
+    order = np.argsort(lons, kind="stable")
+    sorted_lons = lons[order]
+    for zone_id, (min_lon, min_lat, max_lon, max_lat), edges in zones:
+        lo = np.searchsorted(sorted_lons, min_lon, side="left")
+        hi = np.searchsorted(sorted_lons, max_lon, side="right")
+        if lo >= hi:
+            continue
+        candidates = order[lo:hi]
+        candidates = candidates[(lats[candidates] >= min_lat) & (lats[candidates] <= max_lat)]
+        if candidates.size == 0:
+            continue
+        for index in candidates[points_in_edges(lons[candidates], lats[candidates], edges)]:
+            result[index].append(zone_id)
+    return result